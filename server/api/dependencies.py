@@ -0,0 +1,17 @@
+from fastapi import Depends, Request
+from core.utils.database import get_db
+from core.handlers import SessionHandler, SessionContext
+
+##################################################
+# Dependencies shared by the API routers         #
+##################################################
+
+async def check_request_session(request: Request, db=Depends(get_db)) -> SessionContext:
+    """
+    Validates the session cookie of the incoming request.
+
+    Resolved once per request and shared by every route and handler that needs it,
+    returns the SessionContext (session_id, project_id, valid_until) or raises an error.
+    """
+    session_handler = SessionHandler(db)
+    return await session_handler.check_request_session(request)
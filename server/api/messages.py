@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, Body, Request, HTTPException, Query
+from fastapi import APIRouter, Depends, Body, HTTPException, Query
 from core.utils.database import get_db
 from pydantic import BaseModel, Field
 from typing import Annotated, Dict, Optional, Any
 from datetime import datetime
-from core.handlers import MessageHandler, SessionHandler
+from core.handlers import MessageHandler, SessionContext
+from api.dependencies import check_request_session
 from core.utils.exceptions import InternalServerException, BadRequestException, centralized_error_handling
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 ##################################################
 # API routes for message related functionalities #
@@ -23,17 +25,19 @@ class MessageModel(BaseModel):
 def get_message_handler(db=Depends(get_db)):
     return MessageHandler(db)
 
-async def check_request_session(request: Request, db=Depends(get_db)):
-    session_handler = SessionHandler(db)
-    return await session_handler.check_request_session(request)
-
 @centralized_error_handling
 @router.get("/")
 async def get_messages_by_project(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size. Without it every message is returned as a plain list"),
+    after: Optional[str] = Query(None, description="Opaque cursor from the previous page's next_cursor"),
+    stream: bool = Query(False, description="Stream the messages as NDJSON instead of one JSON document"),
     handler: MessageHandler = Depends(get_message_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
-    messages = handler.get_project_messages(valid_session)
+    if stream:
+        filters = await handler.run_async(handler.get_project_message_filters, session)
+        return StreamingResponse(handler._stream(filters), media_type="application/x-ndjson")
+    messages = await handler.run_async(handler.get_project_messages, session, limit=limit, after=after)
     return messages
 
 @centralized_error_handling
@@ -41,8 +45,8 @@ async def get_messages_by_project(
 async def send_message_to_project(
     message_data: MessageModel,
     handler: MessageHandler = Depends(get_message_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     data = jsonable_encoder(message_data)
-    message_id = handler.send_project_message(data, valid_session)
+    message_id = await handler.run_async(handler.send_project_message, data, session)
     return message_id
\ No newline at end of file
@@ -0,0 +1,105 @@
+from fastapi import APIRouter
+import threading
+from core.utils.database import db_pool
+from core.utils.query_cache import query_cache
+from core.utils.id_allocator import id_allocator
+from core.handlers import SessionHandler
+from api.websockets import websocket_manager
+from core.websocket_compression import compression_stats
+from core.utils.exceptions import centralized_error_handling
+
+##################################################
+# Routes for runtime metrics of the server       #
+##################################################
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@centralized_error_handling
+@router.get("/db", summary="Database connection pool metrics", response_description="Pool size, usage and saturation counters")
+async def get_db_metrics():
+    """
+    Current state of the PostgreSQL connection pool.
+
+    - **in_use / idle / size**: Connections checked out, parked and open in total.
+    - **waiting**: Requests currently queued for a free connection.
+    - **saturation**: Share of `max_size` in use.
+    - **timeouts / rejected**: Checkouts that gave up waiting or hit the wait-queue limit.
+    """
+    return db_pool.stats()
+
+@centralized_error_handling
+@router.get("/queries", summary="Compiled query cache metrics", response_description="Cache hits and misses per query shape")
+async def get_query_cache_metrics():
+    """
+    Hit/miss counters of the compiled query cache used by SQLInterface.
+
+    - **per_shape**: Counters per `<verb>:<table>:<clauses>` label, e.g. `select:sessions:sessions_equals`.
+    - **evictions**: Least recently used texts dropped to stay within `maxsize`.
+    """
+    return query_cache.stats()
+
+@centralized_error_handling
+@router.get("/ids", summary="Serial id allocator metrics", response_description="Block sizes and refills per sequence")
+async def get_id_allocator_metrics():
+    """
+    Per sequence counters of the hi/lo id allocator.
+
+    - **refills**: Round trips made to reserve a new block of ids.
+    - **handed_out / available**: Ids given out so far and ids left in the current block.
+    """
+    return id_allocator.stats()
+
+@centralized_error_handling
+@router.get("/sessions", summary="Session cache metrics", response_description="Hit rate and size of the session cache")
+async def get_session_cache_metrics():
+    """
+    Counters of the in-process session caches used to validate session cookies.
+
+    - **valid.hit_rate**: Share of session lookups answered without a database round trip.
+    - **valid.expirations / evictions / invalidations**: Entries dropped by TTL, by the size bound and explicitly.
+    - **rejected.hits**: Requests with a recently rejected (unknown or expired) session id that never reached the database.
+    """
+    return {
+        "valid": SessionHandler.session_cache.stats(),
+        "rejected": SessionHandler.rejected_sessions.stats()
+    }
+
+@centralized_error_handling
+@router.get("/notifications", summary="LISTEN connection metrics", response_description="Channels and rooms served by the LISTEN connection")
+async def get_notification_metrics():
+    """
+    State of the process wide LISTEN connection that feeds the websocket rooms.
+
+    - **connected**: Whether the LISTEN connection is open.
+    - **listen_connections**: Dedicated PostgreSQL connections held for LISTEN (0 or 1, closed a few seconds after the last room leaves).
+    - **projects / channels**: Projects subscribed to and the channels LISTENed on for them.
+    - **rooms / rooms_per_project**: Session rooms sharing those subscriptions.
+    - **room_resources**: Clients, channels, queued events and send queue depth per client of every live room.
+    - **threads**: Live threads of the whole process, database executor included.
+    """
+    return {
+        **websocket_manager.notification_listener.stats(),
+        "room_resources": websocket_manager.room_stats(),
+        "threads": threading.active_count()
+    }
+
+@centralized_error_handling
+@router.get("/websockets", summary="Websocket frame metrics", response_description="Coalescing counters of the websocket rooms")
+async def get_websocket_metrics():
+    """
+    Counters of the change frames pushed to the websocket rooms.
+
+    - **events / frames**: Changes broadcast and the array frames they were coalesced into.
+    - **deduplicated**: Changes merged into a later change of the same row before sending.
+    - **queued_frames / max_queue_depth**: Frames waiting in the clients' send queues, in total and in the fullest one.
+    - **evicted_overflow / evicted_timeout**: Slow clients dropped for a full send queue or a send over the deadline.
+    - **change_log**: Last sequence number and buffered changes per project, and how reconnecting clients were synced.
+      **replays** were sent just the changes they missed, **snapshots** the whole project state.
+    - **compression**: permessage-deflate settings, frames sent compressed and below the minimum size, bytes before/after.
+      Only counted when the server runs with `CompressedWebSocketProtocol` (`python main.py`).
+    """
+    return {
+        **websocket_manager.stats(),
+        "change_log": websocket_manager.notification_listener.change_log.stats(),
+        "compression": compression_stats()
+    }
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, Body, Request, HTTPException, Query, Response, Path, status
+from fastapi import APIRouter, Depends, Body, HTTPException, Query, Response, Path, status
 from core.utils.database import get_db
-from core.handlers import ProjectHandler, SessionHandler
+from core.handlers import ProjectHandler, SessionHandler, SessionContext
+from api.dependencies import check_request_session
 from pydantic import BaseModel, Field
 from typing import Annotated, Dict, Optional, Any, List
 from datetime import datetime
 from core.utils.exceptions import InternalServerException, BadRequestException, NoniAPIException, centralized_error_handling
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 ##################################################
 # API routes for project related functionalities #
@@ -30,39 +32,44 @@ class FilterModel(BaseModel):
         default_factory=dict,
         description="Optional format settings (e.g., sorting, limit, fields)."
     )
+    fields: Optional[List[str]] = Field(
+        None,
+        description="Columns to return. All columns are returned if not set."
+    )
 
 def get_project_handler(db=Depends(get_db)):
     """Get correct handler for project related processes"""
     return ProjectHandler(db)
 
-async def check_request_session(request: Request, db=Depends(get_db)):
-    """
-    Validates the request's session using a session cookie.
-    Returns True if session is valid.
-    """
-    session_handler = SessionHandler(db)
-    return await session_handler.check_request_session(request)
-
 @centralized_error_handling
 @router.get("/all", summary="Fetch all projects", response_description="List of all available projects")
 async def get_all_projects(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size. Without it every project is returned as a plain list"),
+    after: Optional[str] = Query(None, description="Opaque cursor from the previous page's next_cursor"),
+    stream: bool = Query(False, description="Stream the projects as NDJSON instead of one JSON document"),
     handler: ProjectHandler = Depends(get_project_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Retrieve a list of all projects available in the database.
     
+    - **limit / after:** Optional keyset pagination, returns `{"items": [...], "next_cursor": ...}`.
+    - **stream:** Stream every project as NDJSON, read from the database in chunks.
     - **Returns:** List of all project records.
     - **Requires:** A valid session cookie.
     """
-    return handler._get_all()
+    if stream:
+        return StreamingResponse(handler._stream(), media_type="application/x-ndjson")
+    if limit:
+        return await handler.run_async(handler._get_page, limit=limit, after=after)
+    return await handler._get_all_async()
 
 @centralized_error_handling
 @router.get("/{project_id}", summary="Get project by ID", response_description="Project details")
 async def get_project_by_id(
     project_id: int = Path(..., description="The project ID to get data with"),
     handler: ProjectHandler = Depends(get_project_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Get detailed information about a single project by its unique ID.
@@ -73,7 +80,7 @@ async def get_project_by_id(
     """
     if not project_id:
         raise BadRequestException("No project_id found in request parameters")
-    return handler._filter_from(filters=[{
+    return await handler._filter_from_async(filters=[{
         "col": "project_id",
         "clause": "projects_equals",
         "value": project_id,
@@ -84,19 +91,20 @@ async def get_project_by_id(
 async def filter_projects(
     filters: FilterModel,
     handler: ProjectHandler = Depends(get_project_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Query projects using custom filters.
 
     - **filters**: A list of filtering conditions to apply.
     - **format**: Optional formatting options (e.g. pagination, sorting).
+    - **fields**: Optional list of columns to return instead of the full rows.
     - **Returns**: Projects that match the filter criteria.
     - **Requires**: A valid session.
     """
     if not filters.filters:
         raise BadRequestException("No filters found in request parameters")
-    return handler._filter_from(filters=filters.filters, format=filters.format)
+    return await handler._filter_from_async(filters=filters.filters, format=filters.format, fields=filters.fields)
 
 @centralized_error_handling
 @router.post("/", summary="Create a new project", response_description="Session ID for the created project",
@@ -114,7 +122,7 @@ async def create_project(
     - **Sets Cookie**: Stores session ID in an HTTP-only cookie.
     """
     project_data = jsonable_encoder(project_data)
-    session_id, project_id = handler.create_new_project(project_data)
+    session_id, project_id = await handler.run_in_transaction(handler.create_new_project, project_data)
     if session_id and project_id:
         response.set_cookie(
             key=SessionHandler.SESSION_COOKIE_NAME,
@@ -141,7 +149,7 @@ async def join_project(
     - **Returns**: A unique participant ID if successful.
     - **Sets Cookie**: Session ID cookie.
     """
-    session_participant_id = handler.join_project(session_id, username)
+    session_participant_id = await handler.run_in_transaction(handler.join_project, session_id, username)
     if session_participant_id:
         response.set_cookie(
             key=SessionHandler.SESSION_COOKIE_NAME,
@@ -157,7 +165,7 @@ async def join_project(
 async def delete_project(
     project_id: int = Path(..., description="The project ID to delete"),
     handler: ProjectHandler = Depends(get_project_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Delete a project using its ID. 
@@ -167,19 +175,21 @@ async def delete_project(
     - **project_id**: ID of the project to delete.
     - **Returns**: `"success"` if deletion succeeded, `"error"` otherwise.
     """
-    delete_success = handler.delete_projects(
-        project_id=project_id,
-        session_id=valid_session
+    delete_success = await handler.run_in_transaction(
+        handler.delete_projects,
+        project_id=project_id
     )
+    # Only after the commit, a request still seeing the project's sessions could otherwise cache them again
+    SessionHandler.invalidate_cached_sessions(project_id=project_id)
     return "success" if delete_success else "error"
 
 @centralized_error_handling
 @router.post("/participants")
 async def get_project_participants(
     handler: ProjectHandler = Depends(get_project_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
-    participants = handler.get_project_participants(session_id=valid_session)
+    participants = await handler.run_async(handler.get_project_participants, session=session)
     return participants
 
 
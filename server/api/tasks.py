@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, Body, Request, Path
+from fastapi import APIRouter, Depends, Body, Path, Query
 from core.utils.database import get_db
-from core.handlers import TaskHandler, SessionHandler
+from core.handlers import TaskHandler, SessionContext
+from api.dependencies import check_request_session
 from pydantic import BaseModel, Field
-from typing import Annotated, Optional
+from typing import Annotated, Optional, List
 from datetime import datetime
 from core.utils.exceptions import BadRequestException, centralized_error_handling
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from api.projects import FilterModel
 
 ##################################################
@@ -33,35 +35,35 @@ def get_task_handler(db=Depends(get_db)):
     """
     return TaskHandler(db)
 
-async def check_request_session(request: Request, db=Depends(get_db)):
-    """
-    Validates the session of the incoming request.
-    
-    Returns `True` if the session is valid, otherwise raises an error.
-    """
-    session_handler = SessionHandler(db)
-    return await session_handler.check_request_session(request)
-
 @centralized_error_handling
 @router.get("/all", summary="Fetch all tasks", response_description="List of all tasks")
 async def get_all_tasks(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size. Without it every task is returned as a plain list"),
+    after: Optional[str] = Query(None, description="Opaque cursor from the previous page's next_cursor"),
+    stream: bool = Query(False, description="Stream the tasks as NDJSON instead of one JSON document"),
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Retrieve a list of all tasks across all projects.
     
+    - **limit / after**: Optional keyset pagination, returns `{"items": [...], "next_cursor": ...}`.
+    - **stream**: Stream every task as NDJSON, read from the database in chunks.
     - **Returns**: A list of all tasks with details (ID, name, assignee, description, etc.).
     - **Requires**: A valid session token.
     """
-    results = handler._get_all()
+    if stream:
+        return StreamingResponse(handler._stream(), media_type="application/x-ndjson")
+    if limit:
+        return await handler.run_async(handler._get_page, limit=limit, after=after)
+    results = await handler._get_all_async()
     return results
 
 @centralized_error_handling
 @router.get("/", summary="Fetch tasks for a specific project", response_description="List of tasks for the given project")
 async def get_tasks_by_project(
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Retrieve tasks associated with a specific project by its session id.
@@ -69,7 +71,7 @@ async def get_tasks_by_project(
     - **Returns**: A list of tasks associated with the session/project.
     - **Requires**: A valid session token.
     """
-    project_tasks = handler.get_project_tasks_with_session_id(valid_session)
+    project_tasks = await handler.run_async(handler.get_session_project_tasks, session)
     return project_tasks
 
 @centralized_error_handling
@@ -77,18 +79,19 @@ async def get_tasks_by_project(
 async def filter_tasks(
     filters: FilterModel,
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Filter tasks using custom filters (e.g., status, assignee, etc.) and formatting options (e.g., sorting).
     
     - **filters**: A JSON object containing filters and formatting options for the query.
+      Set `fields` to a list of columns to skip shipping the full rows (e.g. long descriptions).
     - **Returns**: A list of tasks that match the filter criteria.
     - **Requires**: A valid session token.
     """
     if not filters.filters:
         raise BadRequestException("No filters found in request parameters")
-    results = handler._filter_from(filters=filters.filters, format=filters.format)
+    results = await handler._filter_from_async(filters=filters.filters, format=filters.format, fields=filters.fields)
     return results
 
 @centralized_error_handling
@@ -96,7 +99,7 @@ async def filter_tasks(
 async def add_task_to_project(
     task_data: TaskModel,
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Create a new task within an existing project.
@@ -106,16 +109,34 @@ async def add_task_to_project(
     - **Requires**: A valid session token.
     """
     task_data = jsonable_encoder(task_data)
-    task_id = handler.add_task_to_project(task_data, valid_session)
+    task_id = await handler.run_in_transaction(handler.add_task_to_project, task_data, session)
     return task_id
 
+@centralized_error_handling
+@router.post("/bulk", summary="Create many tasks at once", response_description="IDs of the new tasks in request order")
+async def add_tasks_to_project(
+    tasks_data: List[TaskModel],
+    handler: TaskHandler = Depends(get_task_handler),
+    session: SessionContext = Depends(check_request_session)
+):
+    """
+    Create a batch of tasks within an existing project, e.g. when importing a board.
+    
+    - **tasks_data**: JSON array of task bodies, same schema as `/tasks/new`.
+    - **Returns**: The IDs of the new tasks, in the same order as the request body.
+    - **Requires**: A valid session token.
+    """
+    tasks_data = jsonable_encoder(tasks_data)
+    task_ids = await handler.run_in_transaction(handler.add_tasks_to_project, tasks_data, session)
+    return task_ids
+
 @centralized_error_handling
 @router.put("/{task_id}", summary="Update an existing task", response_description="ID of the updated task")
 async def update_project_task(
     task_id: int,
     task_data: TaskModel,
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Update an existing task's details in a project.
@@ -125,7 +146,7 @@ async def update_project_task(
     - **Requires**: A valid session token.
     """
     task_data = jsonable_encoder(task_data)
-    task_id = handler.update_project_task(task_data, task_id, valid_session)
+    task_id = await handler.run_in_transaction(handler.update_project_task, task_data, task_id, session)
     return task_id
 
 @centralized_error_handling
@@ -133,7 +154,7 @@ async def update_project_task(
 async def delete_task_from_project(
     task_id: int = Path(..., description="The ID of the task to delete"),
     handler: TaskHandler = Depends(get_task_handler),
-    valid_session: bool = Depends(check_request_session)
+    session: SessionContext = Depends(check_request_session)
 ):
     """
     Delete a specific task by its task ID.
@@ -142,8 +163,9 @@ async def delete_task_from_project(
     - **Returns**: The ID of the deleted task if successful.
     - **Requires**: A valid session token.
     """
-    task_id = handler.delete_task_from_project(
+    task_id = await handler.run_in_transaction(
+        handler.delete_task_from_project,
         task_id=task_id,
-        session_id=valid_session
+        session=session
     )
     return task_id
@@ -1,4 +1,5 @@
-from fastapi import WebSocket, APIRouter, WebSocketDisconnect, Depends
+from fastapi import WebSocket, APIRouter, WebSocketDisconnect, Depends, Query
+from typing import Optional
 from core.utils.exceptions import centralized_error_handling
 from core.websocket_manager import WebsocketManager
 
@@ -15,14 +16,23 @@ async def websocket_endpoint(
     websocket: WebSocket, 
     session_id: str,
     participant_id: int,
+    since: Optional[int] = Query(None, description="Last change sequence number the client has seen, the changes after it are replayed"),
+    epoch: Optional[str] = Query(None, description="Change log epoch the since sequence number belongs to"),
+    encoding: str = Query("json", description="Change frame encoding, json (text frames) or msgpack (binary frames). A noni.msgpack / noni.json subprotocol takes precedence"),
     #valid_session: bool = Depends(check_request_session) # <- Need to add auth to websockets later
 ):
-    await websocket_manager.connect(websocket, session_id, participant_id)
+    if not await websocket_manager.connect(websocket, session_id, participant_id, since, epoch, encoding):
+        return
+    # Only a normal close (1000) is the client leaving the session, anything else may come back with ?since=
+    left = False
     try:
         while True:
             data = await websocket.receive_text()
             await websocket_manager.send_personal_message(f"You wrote: {data}", websocket)
             await websocket_manager.broadcast(f"Client #{participant_id} says: {data}")
-    except WebSocketDisconnect:
-        websocket_manager.disconnect(session_id, websocket)
-        await websocket_manager.broadcast(f"Client #{participant_id} disconnected")
+    except WebSocketDisconnect as e:
+        left = e.code == 1000
+    finally:
+        # Whatever ended the connection, the room and its listener resources are released right away
+        await websocket_manager.disconnect(session_id, websocket, leave=left)
+    await websocket_manager.broadcast(f"Client #{participant_id} disconnected")
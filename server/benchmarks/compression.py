@@ -0,0 +1,120 @@
+"""
+Bandwidth vs CPU of permessage-deflate settings for a realistic stream of websocket change frames:
+mostly single task and message changes, with now and then a coalesced burst of task updates.
+Frames go through the same extension the server negotiates (MinSizePerMessageDeflate) and are
+decompressed like a client would, so context takeover between frames is included.
+
+Needs no database, run from the server/ directory:
+
+    python benchmarks/compression.py --frames 2000 --encoding json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+from core.websocket_compression import MinSizePerMessageDeflate
+from wire_formats import task_event, message_event, ENCODERS
+
+# Settings compared -> {<name>: (<window bits>, <memory level>, <min size>, <no context takeover>)}, None -> uncompressed
+CONFIGS = {
+    "off": None,
+    "zlib defaults (15/8)": (15, 8, 0, False),
+    "12/5, min size 0": (12, 5, 0, False),
+    "12/5, min size 64": (12, 5, 64, False),
+    "12/5, min size 256": (12, 5, 256, False),
+    "10/4, min size 64": (10, 4, 64, False),
+    "12/5, 64, no takeover": (12, 5, 64, True),
+}
+TASK_TYPES = ["backlog", "todo", "in-progress", "done"]
+WORDS = ("fix add remove update login settings page flow review deploy test api database query cache index "
+         "session task message chat board column drag drop bug crash slow fast button modal form error retry "
+         "the a to of for with on in and before after when it this that can we should please check").split()
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for n in range(words)).capitalize()
+
+def build_stream(frames, seed=1):
+    """Frames as lists of changes, like the coalescing websocket manager sends them"""
+    rng = random.Random(seed)
+    stream = []
+    for i in range(frames):
+        roll = rng.random()
+        if roll < 0.6:
+            event = task_event(rng.randint(1, 500), rng.choice(["INSERT", "UPDATE"]))
+            data = event.get("new_data") or event.get("updated_data")
+            data["task_type"] = rng.choice(TASK_TYPES)
+            data["name"] = sentence(rng, rng.randint(2, 6))
+            data["description"] = sentence(rng, rng.randint(0, 40))
+            stream.append([event])
+        elif roll < 0.95:
+            event = message_event(i)
+            event["new_data"]["message_content"] = sentence(rng, rng.randint(1, 25))
+            stream.append([event])
+        else:
+            burst = [task_event(rng.randint(1, 500)) for n in range(rng.randint(10, 100))]
+            for event in burst:
+                event["updated_data"]["description"] = sentence(rng, rng.randint(0, 40))
+            stream.append(burst)
+        for seq, event in enumerate(stream[-1], start=i * 100):
+            event["seq"] = seq
+    return stream
+
+def estimated_memory(window_bits, memory_level):
+    """zlib's documented memory use of the compressor and decompressor of one connection, in bytes"""
+    return (1 << (window_bits + 2)) + (1 << (memory_level + 9)) + (1 << window_bits) + 7 * 1024
+
+def run_config(payloads, config, opcode):
+    raw_bytes = sum(len(payload) for payload in payloads)
+    if config is None:
+        return {"bytes": raw_bytes, "ratio": 1.0, "compress_ms": 0.0, "decompress_ms": 0.0, "memory_kb": 0.0}
+    window_bits, memory_level, min_size, no_takeover = config
+    # Server side compresses, client side decompresses, with the parameters they would have negotiated
+    server = MinSizePerMessageDeflate(no_takeover, no_takeover, window_bits, window_bits,
+                                      {"memLevel": memory_level}, min_size=min_size)
+    client = PerMessageDeflate(no_takeover, no_takeover, window_bits, window_bits)
+    started = time.perf_counter()
+    frames = [server.encode(Frame(opcode, payload)) for payload in payloads]
+    compress_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    decoded = [client.decode(frame) for frame in frames]
+    decompress_ms = (time.perf_counter() - started) * 1000
+    assert [bytes(frame.data) for frame in decoded] == payloads
+    sent_bytes = sum(len(frame.data) for frame in frames)
+    return {
+        "bytes": sent_bytes,
+        "ratio": sent_bytes / raw_bytes,
+        "compress_ms": compress_ms,
+        "decompress_ms": decompress_ms,
+        "memory_kb": estimated_memory(window_bits, memory_level) / 1024
+    }
+
+def print_report(results, frames):
+    print(f"{'settings':<28}{'kB sent':>10}{'ratio':>8}{'compress ms':>13}{'decompress ms':>15}{'mem/conn kB':>13}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['bytes'] / 1024:>10.1f}{result['ratio']:>8.0%}{result['compress_ms']:>13.1f}"
+              f"{result['decompress_ms']:>15.1f}{result['memory_kb']:>13.0f}")
+    print(f"{frames} frames")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=2000, help="Frames in the stream")
+    parser.add_argument("--encoding", default="json", choices=list(ENCODERS), help="Wire format of the frames")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    payloads = [ENCODERS[args.encoding](frame) for frame in build_stream(args.frames)]
+    opcode = Opcode.TEXT if args.encoding == "json" else Opcode.BINARY
+    results = {name: run_config(payloads, config, opcode) for name, config in CONFIGS.items()}
+    print_report(results, args.frames)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"frames": args.frames, "encoding": args.encoding, "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
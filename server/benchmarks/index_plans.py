@@ -0,0 +1,173 @@
+"""
+Seeds N projects x M tasks/messages into a scratch schema of the local NoniDB and records
+EXPLAIN ANALYZE timings of the hot lookups before and after the index migrations.
+
+Run from the server/ directory, so the database credentials are read from environment/.env.development:
+
+    python benchmarks/index_plans.py --projects 200 --rows 500
+
+Exits with 1 if a hot lookup still sequentially scans its table, or a keyset page still sorts its rows, after the
+migrations, so index regressions get caught.
+Tables smaller than --min-rows are left out of that check, the planner rightly prefers a seq scan for those.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from core.utils.database import get_dedicated_db
+
+SCHEMA = "noni_index_bench"
+MIGRATIONS = [
+    os.path.join(os.path.dirname(__file__), "..", "environment", "migrations", migration)
+    for migration in ("0002_hot_lookup_indexes.sql", "0005_messages_keyset_index.sql")
+]
+TABLES = ["projects", "sessions", "session_participants", "tasks", "messages"]
+
+# Same lookups the handlers run -> (name, table, query). %(project_id)s / %(session_id)s / %(after)s are filled per sample.
+# Pages are the keyset pages of HandlerInterface._get_page, %(after)s is an id halfway through the project's rows.
+HOT_QUERIES = [
+    ("tasks by project", "tasks", "SELECT * FROM tasks WHERE project_id = %(project_id)s"),
+    ("tasks page by project", "tasks",
+        "SELECT * FROM tasks WHERE project_id = %(project_id)s AND id > %(after)s ORDER BY id LIMIT 50"),
+    ("messages by project", "messages", "SELECT * FROM messages WHERE project_id = %(project_id)s"),
+    ("messages page by project", "messages",
+        "SELECT * FROM messages WHERE project_id = %(project_id)s AND id > %(after)s ORDER BY id LIMIT 50"),
+    ("participants by session", "session_participants",
+        "SELECT * FROM session_participants WHERE session_uuid = %(session_id)s"),
+    ("sessions by project", "sessions", "SELECT * FROM sessions WHERE project_id = %(project_id)s"),
+]
+
+def create_schema(cursor):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    for table in TABLES:
+        # Copies columns and defaults only -> no constraints, indexes or notify triggers
+        cursor.execute(f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING DEFAULTS)")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+
+def seed(cursor, projects, rows):
+    cursor.execute("""
+        INSERT INTO projects (project_id, project_name, created_at, modified_at)
+        SELECT p, 'bench project ' || p, now(), now() FROM generate_series(1, %(projects)s) p
+    """, {"projects": projects})
+    cursor.execute("""
+        INSERT INTO sessions (session_id, project_id, valid_until)
+        SELECT md5('session' || p)::uuid, p, now() + interval '1 year' FROM generate_series(1, %(projects)s) p
+    """, {"projects": projects})
+    cursor.execute("""
+        INSERT INTO session_participants (participant_id, session_uuid, participant_name, joined_at)
+        SELECT (p - 1) * 5 + n, md5('session' || p)::uuid, 'participant ' || n, now()
+        FROM generate_series(1, %(projects)s) p, generate_series(1, 5) n
+    """, {"projects": projects})
+    cursor.execute("""
+        INSERT INTO tasks (id, project_id, name, assignee, description, start_date, end_date, added_at, task_type)
+        SELECT (p - 1) * %(rows)s + n, p, 'task ' || n, 'assignee ' || (n %% 7), repeat('description ', 20),
+            now(), now() + interval '14 days', now(), (ARRAY['todo', 'in-progress', 'backlog', 'done'])[1 + n %% 4]
+        FROM generate_series(1, %(projects)s) p, generate_series(1, %(rows)s) n
+    """, {"projects": projects, "rows": rows})
+    cursor.execute("""
+        INSERT INTO messages (id, project_id, session_participant_id, message_sender, message_content, message_timestamp)
+        SELECT (p - 1) * %(rows)s + n, p, (p - 1) * 5 + 1 + n %% 5, 'participant ' || (1 + n %% 5),
+            repeat('message ', 10), now() - (n || ' seconds')::interval
+        FROM generate_series(1, %(projects)s) p, generate_series(1, %(rows)s) n
+    """, {"projects": projects, "rows": rows})
+    for table in TABLES:
+        cursor.execute(f"ANALYZE {table}")
+
+def find_nodes(plan, found=None):
+    found = [] if found is None else found
+    found.append((plan.get("Node Type"), plan.get("Relation Name")))
+    for child in plan.get("Plans", []):
+        find_nodes(child, found)
+    return found
+
+def explain(cursor, projects, rows, samples):
+    results = {}
+    for name, table, query in HOT_QUERIES:
+        timings = []
+        nodes = set()
+        for i in range(samples):
+            project_id = 1 + (i * 7919) % projects
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, FORMAT JSON) {query}",
+                {
+                    "project_id": project_id,
+                    "session_id": _session_uuid(cursor, project_id),
+                    "after": (project_id - 1) * rows + rows // 2
+                }
+            )
+            plan = cursor.fetchone()[0][0]
+            timings.append(plan["Execution Time"])
+            nodes.update(find_nodes(plan["Plan"]))
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+        results[name] = {
+            "table": table,
+            "table_rows": cursor.fetchone()[0],
+            "median_ms": statistics.median(timings),
+            "max_ms": max(timings),
+            "seq_scan": ("Seq Scan", table) in nodes,
+            # A keyset page served by the right index comes out of it in order
+            "sort": any(node == "Sort" for node, relation in nodes),
+            "nodes": sorted(f"{node} on {relation}" if relation else node for node, relation in nodes)
+        }
+    return results
+
+def _session_uuid(cursor, project_id):
+    cursor.execute("SELECT md5('session' || %s)::uuid::text", (project_id,))
+    return cursor.fetchone()[0]
+
+def apply_migrations(cursor):
+    for migration in MIGRATIONS:
+        with open(migration) as file:
+            cursor.execute(file.read())
+    for table in TABLES:
+        cursor.execute(f"ANALYZE {table}")
+
+def print_report(before, after):
+    print(f"{'query':<26}{'before ms':>12}{'after ms':>12}{'speedup':>10}  plan after")
+    for name in before:
+        speedup = before[name]["median_ms"] / after[name]["median_ms"] if after[name]["median_ms"] else float("inf")
+        print(f"{name:<26}{before[name]['median_ms']:>12.3f}{after[name]['median_ms']:>12.3f}{speedup:>9.1f}x  "
+              f"{', '.join(after[name]['nodes'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=200, help="Number of projects to seed")
+    parser.add_argument("--rows", type=int, default=500, help="Tasks and messages seeded per project")
+    parser.add_argument("--samples", type=int, default=20, help="EXPLAIN ANALYZE runs per query")
+    parser.add_argument("--min-rows", type=int, default=5000, help="Smallest table size checked for seq scans")
+    parser.add_argument("--output", help="Write the before/after results as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {SCHEMA} schema after the run")
+    args = parser.parse_args()
+
+    conn = get_dedicated_db()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        print(f"Seeding {args.projects} projects x {args.rows} tasks/messages into schema {SCHEMA}...")
+        create_schema(cursor)
+        seed(cursor, args.projects, args.rows)
+        before = explain(cursor, args.projects, args.rows, args.samples)
+        apply_migrations(cursor)
+        after = explain(cursor, args.projects, args.rows, args.samples)
+        print_report(before, after)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump({"projects": args.projects, "rows": args.rows, "before": before, "after": after}, file, indent=2)
+        regressions = [
+            name for name, result in after.items()
+            if (result["seq_scan"] or result["sort"]) and result["table_rows"] >= args.min_rows
+        ]
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+    if regressions:
+        print(f"Sequential scans or sorts left after migrations: {regressions}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Times bulk INSERT / UPDATE / DELETE of tasks in a scratch schema of the local NoniDB with each kind of notify trigger,
+and counts the notifications (and payload bytes) a LISTEN connection receives for them:
+
+    row        FOR EACH ROW -> notify_changes_after_insert(), whole row payloads (triggers.sql)
+    row_ids    FOR EACH ROW -> notify_change_ids('id'), id only payloads (migration 0003)
+    statement  FOR EACH STATEMENT with transition tables -> notify_tasks_changes() (migration 0004)
+
+Run from the server/ directory, so the database credentials are read from environment/.env.development:
+
+    python benchmarks/trigger_bulk_dml.py --projects 10 --rows 1000
+
+The trigger functions are (re)created from environment/functions.sql first.
+"""
+import argparse
+import json
+import os
+import select
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from core.utils.database import get_dedicated_db
+
+SCHEMA = "noni_trigger_bench"
+FUNCTIONS = os.path.join(os.path.dirname(__file__), "..", "environment", "functions.sql")
+OPERATIONS = ["INSERT", "UPDATE", "DELETE"]
+
+# Trigger definitions per mode -> {<mode>: [(<operation>, <trigger body>), ...]}
+TRIGGER_MODES = {
+    "row": [
+        (operation, "FOR EACH ROW EXECUTE FUNCTION notify_changes_after_insert()")
+        for operation in OPERATIONS
+    ],
+    "row_ids": [
+        (operation, "FOR EACH ROW EXECUTE FUNCTION notify_change_ids('id')")
+        for operation in OPERATIONS
+    ],
+    "statement": [
+        (operation, f"REFERENCING {'OLD TABLE AS old_rows' if operation == 'DELETE' else 'NEW TABLE AS new_rows'} "
+                    "FOR EACH STATEMENT EXECUTE FUNCTION notify_tasks_changes()")
+        for operation in OPERATIONS
+    ],
+}
+
+# Bulk statements, %(projects)s / %(rows)s -> rows per project
+STATEMENTS = {
+    "INSERT": """
+        INSERT INTO tasks (id, project_id, name, assignee, description, start_date, end_date, added_at, task_type)
+        SELECT (p - 1) * %(rows)s + n, p, 'task ' || n, 'assignee', repeat('description ', 10),
+            now(), now() + interval '14 days', now(), 'todo'
+        FROM generate_series(1, %(projects)s) p, generate_series(1, %(rows)s) n
+    """,
+    "UPDATE": "UPDATE tasks SET task_type = 'done'",
+    "DELETE": "DELETE FROM tasks",
+}
+
+def create_schema(cursor, mode):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    # Copies columns and defaults only -> no constraints, indexes or the notify triggers of public.tasks
+    cursor.execute(f"CREATE TABLE {SCHEMA}.tasks (LIKE public.tasks INCLUDING DEFAULTS)")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public")
+    for operation, body in TRIGGER_MODES[mode]:
+        cursor.execute(f"CREATE TRIGGER bench_notify_{operation.lower()} AFTER {operation} ON tasks {body}")
+
+def drain(listen_conn, timeout=1.0):
+    """Collect notifications until the connection has been quiet for timeout seconds"""
+    notifies = []
+    while select.select([listen_conn], [], [], timeout)[0]:
+        listen_conn.poll()
+        while listen_conn.notifies:
+            notifies.append(listen_conn.notifies.pop(0))
+    return notifies
+
+def run_mode(cursor, listen_conn, mode, projects, rows):
+    create_schema(cursor, mode)
+    results = {}
+    for operation in OPERATIONS:
+        started = time.perf_counter()
+        cursor.execute(STATEMENTS[operation], {"projects": projects, "rows": rows})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        notifies = drain(listen_conn)
+        announced = sum(len(json.loads(notify.payload).get("ids", [None])) for notify in notifies)
+        results[operation] = {
+            "ms": elapsed_ms,
+            "notifications": len(notifies),
+            "payload_bytes": sum(len(notify.payload.encode()) for notify in notifies),
+            "rows_announced": announced
+        }
+    return results
+
+def print_report(report, expected_rows):
+    print(f"{'mode':<11}{'operation':<11}{'ms':>10}{'notifies':>10}{'payload kB':>12}{'rows':>8}")
+    for mode, results in report.items():
+        for operation, result in results.items():
+            print(f"{mode:<11}{operation:<11}{result['ms']:>10.1f}{result['notifications']:>10}"
+                  f"{result['payload_bytes'] / 1024:>12.1f}{result['rows_announced']:>8}")
+    print(f"Each operation changes {expected_rows} rows")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=10, help="Number of projects the tasks are spread over")
+    parser.add_argument("--rows", type=int, default=1000, help="Tasks per project")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode, the median run is reported")
+    parser.add_argument("--modes", nargs="+", default=list(TRIGGER_MODES), choices=list(TRIGGER_MODES))
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    conn = get_dedicated_db()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    listen_conn = get_dedicated_db()
+    listen_conn.autocommit = True
+    listen_cursor = listen_conn.cursor()
+    try:
+        with open(FUNCTIONS) as file:
+            cursor.execute(file.read())
+        for project_id in range(1, args.projects + 1):
+            listen_cursor.execute(f"LISTEN tasks_channel_{project_id}")
+        report = {}
+        for mode in args.modes:
+            runs = [run_mode(cursor, listen_conn, mode, args.projects, args.rows) for i in range(args.repeat)]
+            report[mode] = {
+                operation: sorted((run[operation] for run in runs), key=lambda result: result["ms"])[len(runs) // 2]
+                for operation in OPERATIONS
+            }
+        print_report(report, args.projects * args.rows)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump({"projects": args.projects, "rows": args.rows, "results": report}, file, indent=2)
+    finally:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        listen_conn.close()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the JSON and MessagePack encodings of the websocket change frames: frame size and the time to
+encode (server, once per room) and decode (client) typical task and message events.
+
+Needs no database, the events are built in the same shape the notification listener sends them:
+
+    python benchmarks/wire_formats.py --frame-size 100 --snapshot-tasks 500
+"""
+import argparse
+import json
+import statistics
+import timeit
+import msgpack
+
+DESCRIPTION = "Fix the login flow on the settings page, see the chat for the details. " * 3
+
+def task_event(id, operation="UPDATE"):
+    data_key = {"INSERT": "new_data", "UPDATE": "updated_data"}[operation]
+    return {
+        "operation": operation,
+        "table": "tasks",
+        data_key: {
+            "id": id,
+            "project_id": 42,
+            "name": f"Task number {id}",
+            "assignee": "miikaran",
+            "description": DESCRIPTION,
+            "start_date": "2025-04-09",
+            "end_date": "2025-04-28",
+            "added_at": "2025-04-09T12:31:45.123456",
+            "task_type": "in-progress"
+        },
+        "seq": id
+    }
+
+def message_event(id):
+    return {
+        "operation": "INSERT",
+        "table": "messages",
+        "new_data": {
+            "id": id,
+            "project_id": 42,
+            "session_participant_id": 7,
+            "message_sender": "miikaran",
+            "message_content": "Pushed the fix, can someone review it before the standup?",
+            "message_timestamp": "2025-04-09T12:31:45.123456"
+        },
+        "seq": id
+    }
+
+def build_payloads(frame_size, snapshot_tasks):
+    return {
+        "task event": [task_event(1, "INSERT")],
+        "message event": [message_event(1)],
+        f"frame of {frame_size} tasks": [task_event(id) for id in range(frame_size)],
+        f"snapshot of {snapshot_tasks} tasks": {
+            "operation": "SNAPSHOT",
+            "epoch": "3f9c2a1b",
+            "seq": snapshot_tasks,
+            "snapshot_data": {
+                "tasks": [task_event(id)["updated_data"] for id in range(snapshot_tasks)],
+                "messages": [message_event(id)["new_data"] for id in range(50)],
+                "participants": []
+            }
+        }
+    }
+
+# Same encoding the server uses -> WebsocketManager.encode
+ENCODERS = {
+    "json": lambda payload: json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode(),
+    "msgpack": lambda payload: msgpack.packb(payload)
+}
+DECODERS = {
+    "json": lambda frame: json.loads(frame),
+    "msgpack": lambda frame: msgpack.unpackb(frame)
+}
+
+def measure(function, argument, number, repeat):
+    """Median time of one call in microseconds"""
+    runs = timeit.repeat(lambda: function(argument), number=number, repeat=repeat)
+    return statistics.median(runs) / number * 1e6
+
+def run(payloads, number, repeat):
+    results = {}
+    for name, payload in payloads.items():
+        results[name] = {}
+        for encoding, encode in ENCODERS.items():
+            frame = encode(payload)
+            assert DECODERS[encoding](frame) == payload
+            results[name][encoding] = {
+                "bytes": len(frame),
+                "encode_us": measure(encode, payload, number, repeat),
+                "decode_us": measure(DECODERS[encoding], frame, number, repeat)
+            }
+    return results
+
+def print_report(results):
+    print(f"{'payload':<24}{'encoding':<10}{'bytes':>10}{'encode us':>12}{'decode us':>12}{'size':>8}")
+    for name, encodings in results.items():
+        json_bytes = encodings["json"]["bytes"]
+        for encoding, result in encodings.items():
+            print(f"{name:<24}{encoding:<10}{result['bytes']:>10}{result['encode_us']:>12.1f}"
+                  f"{result['decode_us']:>12.1f}{result['bytes'] / json_bytes:>7.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frame-size", type=int, default=100, help="Changes per coalesced frame")
+    parser.add_argument("--snapshot-tasks", type=int, default=500, help="Tasks in the snapshot payload")
+    parser.add_argument("--number", type=int, default=200, help="Calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs, the median run is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(build_payloads(args.frame_size, args.snapshot_tasks), args.number, args.repeat)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from core.utils.database import POSTGRE_POOL_SETTINGS
+
+"""
+psycopg2 only talks to the server with blocking socket calls. Instead of running them on the event loop,
+every awaited database call is shipped to this executor. It is sized to the connection pool, so there are
+never more threads blocked on PostgreSQL than there are connections to serve them.
+Calls on db_executor run on a connection their request already holds. Jobs that check out a pool connection
+themselves (websocket and notification work) run on db_connection_executor instead, otherwise they could take
+every db_executor thread while waiting for a connection held by a request that waits for a thread.
+"""
+db_executor = ThreadPoolExecutor(
+    max_workers=POSTGRE_POOL_SETTINGS["max_size"],
+    thread_name_prefix="noni-db"
+)
+db_connection_executor = ThreadPoolExecutor(
+    max_workers=POSTGRE_POOL_SETTINGS["max_size"],
+    thread_name_prefix="noni-db-connection"
+)
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Await a blocking database call without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+async def run_in_db_connection_executor(func, *args, **kwargs):
+    """Await a blocking job that checks out its own pool connection"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_connection_executor, partial(func, *args, **kwargs))
+
+class AsyncSQLInterface:
+    """Awaitable variant of SQLInterface, wrapping a model and running its queries on the db executor"""
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def table(self):
+        return self.model.table
+
+    async def select(self, params, **kwargs):
+        return await run_in_db_executor(self.model.select, params, **kwargs)
+
+    async def insert(self, values, **kwargs):
+        return await run_in_db_executor(self.model.insert, values, **kwargs)
+
+    async def insert_many(self, values, **kwargs):
+        return await run_in_db_executor(self.model.insert_many, values, **kwargs)
+
+    async def copy_many(self, values, **kwargs):
+        return await run_in_db_executor(self.model.copy_many, values, **kwargs)
+
+    async def update(self, params):
+        return await run_in_db_executor(self.model.update, params)
+
+    async def delete(self, params):
+        return await run_in_db_executor(self.model.delete, params)
+
+    async def exists(self, params, **kwargs):
+        return await run_in_db_executor(self.model.exists, params, **kwargs)
+
+    async def already_exists(self, filter_params):
+        return await run_in_db_executor(self.model.already_exists, filter_params)
@@ -2,23 +2,91 @@ from .models.projects_model import ProjectsModel
 from .models.messages_model import MessagesModel
 from .models.tasks_model import TasksModel
 from .models.sessions_model import SessionsModel, SessionParticipantsModel
-from datetime import datetime, timedelta
+from .async_sql_interface import AsyncSQLInterface, run_in_db_executor
+from core.utils.database import db_pool
+from core.utils.pagination import create_page, decode_cursor, to_ndjson
+from core.utils.cache import TTLCache
+from datetime import datetime, timedelta, time, date
+from dataclasses import dataclass
 import uuid
 from core.utils.exceptions import BadRequestException, NotFoundException, ConflictException, InternalServerException, NoniAPIException, UnauthorizedException
 
+@dataclass(frozen=True)
+class SessionContext:
+    """Session of the current request, resolved once from the session cookie"""
+    session_id: str
+    project_id: int
+    valid_until: date
+
 class HandlerInterface:
     """Represents a generic interface for handling API requests for database stuff"""
     def __init__(self, db: object, target_model: object):
         self.db = db
         self.model = target_model(db)
+        self.async_model = AsyncSQLInterface(self.model)
+
+    async def run_async(self, method, *args, **kwargs):
+        """Await a blocking handler method on the database executor instead of the event loop"""
+        return await run_in_db_executor(method, *args, **kwargs)
+
+    def transaction(self):
+        """Unit of work -> statements of all handlers sharing this db connection commit once, or roll back together"""
+        return self.model.transaction()
+
+    def _run_in_transaction(self, method, *args, **kwargs):
+        with self.transaction():
+            return method(*args, **kwargs)
+
+    async def run_in_transaction(self, method, *args, **kwargs):
+        """Like run_async, but the whole method runs as a single unit of work"""
+        return await run_in_db_executor(self._run_in_transaction, method, *args, **kwargs)
     
     def _get_all(self) -> list:
         """Method for getting all data from model"""
         return self.model.select({}, all=True)
     
-    def _filter_from(self, filters: list, format: dict={}) -> list:
-        """Method to filter data from model with filters"""
-        return self.model.select(filters, **format)
+    def _get_projection(self, format: dict={}, fields: list=None) -> tuple:
+        """Split the requested columns out of format, checking that the model has them"""
+        format = dict(format or {})
+        fields = fields or format.pop("fields", None)
+        format.pop("fields", None)
+        if fields:
+            unknown_fields = [field for field in fields if field not in self.model.get_column_names()]
+            if unknown_fields:
+                raise BadRequestException(f"Unknown fields for {self.model.table}: {unknown_fields}")
+        return format, fields
+
+    def _filter_from(self, filters: list, format: dict={}, fields: list=None) -> list:
+        """Method to filter data from model with filters, optionally projected to fields"""
+        format, fields = self._get_projection(format, fields)
+        return self.model.select(filters, **format, fields=fields)
+
+    def _get_page(self, filters: list=None, limit: int=50, after: str=None) -> dict:
+        """Method to get one keyset page of data from model, optionally filtered"""
+        # One row more than the page, it only tells whether there is a next page
+        rows = self.model.select(
+            filters,
+            all=not filters,
+            limit=limit + 1,
+            after=decode_cursor(after) if after else None
+        )
+        return create_page(rows, self.model.get_primary_key(), limit)
+
+    def _stream(self, filters: list=None, chunk_size: int=500):
+        """Method to stream data from model as NDJSON lines, read in chunks from a server side cursor"""
+        # The response body is sent after the request scoped connection is returned -> use a connection of our own
+        with db_pool.connection() as db:
+            model = type(self.model)(db)
+            yield from to_ndjson(model.stream(filters, chunk_size=chunk_size))
+
+    async def _get_all_async(self) -> list:
+        """Awaitable variant of _get_all"""
+        return await self.async_model.select({}, all=True)
+
+    async def _filter_from_async(self, filters: list, format: dict={}, fields: list=None) -> list:
+        """Awaitable variant of _filter_from"""
+        format, fields = self._get_projection(format, fields)
+        return await self.async_model.select(filters, **format, fields=fields)
     
     @staticmethod
     def get_all(db: object, model: object) -> list:
@@ -28,8 +96,12 @@ class HandlerInterface:
     def filter_from(db: object, model: object, filters: list, format: dict={}) -> list:
         return model(db).select(filters, **format)
     
-    def add_record(self, data: dict, required_cols: list, unique: dict={}, return_col: str="") -> bool | tuple:
-        """General method for adding records to a model"""
+    def add_record(self, data: dict, required_cols: list, unique: dict={}, return_col: str="", upsert: dict=None) -> bool | tuple:
+        """
+        General method for adding records to a model.
+        unique -> insert is skipped with ON CONFLICT DO NOTHING and a ConflictException raised if the value exists.
+        upsert -> on_conflict options passed to the insert, e.g. {"cols": [...], "action": "update"}.
+        """
         if not data:
             print(f"Data for {self.model.table} insert not found")
             raise BadRequestException("No data provided for insertion")
@@ -37,24 +109,55 @@ class HandlerInterface:
             if key not in data:
                 print(f"Required {key} not found in new record to {self.model.table}")
                 raise BadRequestException(f"Required key '{key}' not found in record")
+        on_conflict = upsert
         if unique:
-            already_exists = self.model.already_exists(unique)
-            if already_exists:
-                col = unique.get("col")
-                value = unique.get("value")
-                print(f"{col} with value {value} already exists in {self.model.table}")
-                raise ConflictException(f"Record already exists: {col} -> {value}")
+            # Existence check and insert in one statement -> the unique column needs a unique index
+            on_conflict = {"cols": [unique.get("col")], "action": "nothing"}
         ordered_data = self.model.sort_row_values_by_columns(data)
         success, rows_updated, id = self.model.insert(
             values=[tuple(ordered_data.values())], 
-            returning=return_col
+            returning=return_col,
+            on_conflict=on_conflict
             )
+        if unique and not success:
+            col = unique.get("col")
+            value = unique.get("value")
+            print(f"{col} with value {value} already exists in {self.model.table}")
+            raise ConflictException(f"Record already exists: {col} -> {value}")
         if success and id:
             print(f"New record created to {self.model.table} with id: {id}")
             return success, id
         print(f"Failed to add a record to {self.model.table}")
         raise InternalServerException(f"Failed to insert record into {self.model.table}")
 
+    def add_records(self, rows: list, required_cols: list, return_col: str="", copy: bool=False) -> list:
+        """
+        General method for bulk adding records to a model, returns the new ids in row order.
+        With copy the rows are streamed through COPY, return_col must then be the serial id column.
+        """
+        if not rows:
+            print(f"Data for {self.model.table} bulk insert not found")
+            raise BadRequestException("No data provided for insertion")
+        for i, data in enumerate(rows):
+            for key in required_cols:
+                if key not in data:
+                    print(f"Required {key} not found in row {i} of bulk insert to {self.model.table}")
+                    raise BadRequestException(f"Required key '{key}' not found in record {i}")
+        values = [tuple(self.model.sort_row_values_by_columns(data).values()) for data in rows]
+        invalid_rows = self.model.get_invalid_rows(values)
+        if invalid_rows:
+            raise BadRequestException(f"Invalid datatypes in records: {invalid_rows}")
+        # Every row was just validated, the model doesn't check them again
+        if copy:
+            success, rows_inserted, ids = self.model.copy_many(values=values, id_col=return_col, validated=True)
+        else:
+            success, rows_inserted, ids = self.model.insert_many(values=values, returning=return_col, validated=True)
+        if success and rows_inserted == len(rows):
+            print(f"{rows_inserted} new records created to {self.model.table}")
+            return ids
+        print(f"Failed to bulk add records to {self.model.table}")
+        raise InternalServerException(f"Failed to insert records into {self.model.table}")
+
     def update_record(self, id, updated_data: dict, clauses: list) -> bool:
         """General method for updating records in model"""
         if not id:
@@ -98,19 +201,14 @@ class ProjectHandler(HandlerInterface):
     
     def create_new_project(self, project_data: dict) -> bool | tuple:
         """Method for creating a project, including session"""
-        success, project_id = self.add_project(project_data)
-        if not (success and project_id):
-            raise InternalServerException("Failed to create a new project")
-        success, session_id = SessionHandler(self.db).create_session({"project_id": project_id})
-        if not (success and session_id):
-            # Remove the new project if couldn't create a session for it
-            deleted = self.delete_projects(project_id=project_id)
-            if deleted:
-                print(f"Removed project {project_id} for invalid session initialization")
-            else: 
-                print(f"Session initialization and delete failed for project: {project_id}")
-                raise InternalServerException(f"Rollback for project: {project_id} failed after failed session init")
-            raise InternalServerException("Failed to create a new project")
+        # Project and its session are committed together -> a failed session init leaves no orphan project behind
+        with self.transaction():
+            success, project_id = self.add_project(project_data)
+            if not (success and project_id):
+                raise InternalServerException("Failed to create a new project")
+            success, session_id = SessionHandler(self.db).create_session({"project_id": project_id})
+            if not (success and session_id):
+                raise InternalServerException("Failed to create a new project")
         # Otherwise -> return the session id & project_id for joining
         return session_id, project_id
             
@@ -132,12 +230,11 @@ class ProjectHandler(HandlerInterface):
             return_col="project_id"
         )
             
-    def delete_projects(self, project_id=None, filters={}, session_id=None):   
-        """Method for deleting project with id or filters"""
-        if session_id and project_id:
-            is_valid = SessionHandler(self.db).is_valid_session(session_id=session_id)
-            if not is_valid:
-                raise InternalServerException("Invalid session for deleting projects")
+    def delete_projects(self, project_id=None, filters={}):   
+        """
+        Method for deleting project with id or filters. Its sessions are removed with it (ON DELETE CASCADE),
+        callers drop them from the session cache once the delete is committed.
+        """
         return self.delete_record(
             id=project_id,
             filters=filters,
@@ -166,11 +263,11 @@ class ProjectHandler(HandlerInterface):
         participant_id = session_participant_handler.add_session_participant(session_id, username)
         return participant_id
     
-    def get_project_participants(self, session_id):
-        if not session_id:
-            raise BadRequestException("No session id found")
+    def get_project_participants(self, session: SessionContext):
+        if not session:
+            raise BadRequestException("No session found")
         session_participant_handler = SessionParticipantHandler(self.db)
-        participants = session_participant_handler.get_session_participants(session_id)
+        participants = session_participant_handler.get_session_participants(session.session_id)
         sorted_participants = sorted(participants, key=lambda p: p["joined_at"], reverse=True)
         return sorted_participants[:5]
 
@@ -179,6 +276,15 @@ class SessionHandler(HandlerInterface):
     SESSION_COOKIE_NAME = "session_id"
     SESSION_EXPIRATION_DAYS = 365
     SESSION_EXPIRATION_SECONDS = SESSION_EXPIRATION_DAYS * 24 * 60 * 60
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL_SECONDS = 60
+    CACHED_SESSION_FIELDS = ("session_id", "project_id", "valid_until")
+    # Shared by every handler in the process -> {<session_id>: {"session_id", "project_id", "valid_until"}}
+    session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+    REJECTED_SESSION_CACHE_SIZE = 10000
+    REJECTED_SESSION_TTL_SECONDS = 30
+    # Recently rejected unknown or expired session ids -> {<session_id>: (<status_code>, <detail>)}
+    rejected_sessions = TTLCache(maxsize=REJECTED_SESSION_CACHE_SIZE, ttl=REJECTED_SESSION_TTL_SECONDS)
 
     def __init__(self, db):
         super().__init__(db=db, target_model=SessionsModel)
@@ -186,25 +292,86 @@ class SessionHandler(HandlerInterface):
         self.valid_until = self.get_valid_until(self.SESSION_EXPIRATION_DAYS)
     
     async def check_request_session(self, request=None):
-        """Check session validity from request cookies"""
+        """Check session validity from request cookies and resolve it to a SessionContext"""
         session_id = request.cookies.get(self.SESSION_COOKIE_NAME)
         if not session_id:
             raise UnauthorizedException()
-        is_valid_session = self.is_valid_session(session_id=session_id)
-        if not is_valid_session:
-            raise NoniAPIException(status_code=403, detail="Session expired or invalid")
-        return session_id
+        return await self.run_async(self.resolve_session, session_id)
 
-    def get_session(self, session_id):
-        """Get session with session id"""
+    def resolve_session(self, session_id):
+        """Validate session and resolve it to its project in a single lookup"""
         if not session_id:
             raise BadRequestException("No session id provided")
+        # Clients retrying with a stale cookie get the same answer without a round trip to the sessions table
+        rejection = self.rejected_sessions.get(str(session_id))
+        if rejection is not None:
+            status_code, detail = rejection
+            raise NoniAPIException(status_code=status_code, detail=detail)
+        session = self.get_cached_session(session_id)
+        if not session:
+            self.reject_session(session_id, 404, f"session_id:{session_id} not found in sessions")
+        if not session["valid_until"] > datetime.now().date():
+            self.invalidate_cached_sessions(session_id=session_id)
+            self.reject_session(session_id, 403, "Session expired or invalid")
+        if not session["project_id"]:
+            raise NotFoundException(f"Project not found for session id: {session_id}")
+        return SessionContext(
+            session_id=str(session["session_id"]),
+            project_id=int(session["project_id"]),
+            valid_until=session["valid_until"]
+        )
+
+    def get_cached_session(self, session_id):
+        """Get session_id, project_id and valid_until of a session, from the session cache when possible"""
+        session = self.session_cache.get(str(session_id))
+        if session is not None:
+            return session
+        session_data = self._filter_from(
+            filters=[{
+                "col": "session_id",
+                "clause": "sessions_equals",
+                "value": str(session_id)
+            }],
+            fields=list(self.CACHED_SESSION_FIELDS)
+        )
+        if not session_data:
+            return None
+        session = dict(session_data[0])
+        # Never keep the entry around past the moment the session expires
+        expires_in = (datetime.combine(session["valid_until"], time.min) - datetime.now()).total_seconds()
+        self.session_cache.set(str(session_id), session, ttl=expires_in)
+        return session
+
+    @classmethod
+    def reject_session(cls, session_id, status_code, detail):
+        """Remember the rejected session id for a while and raise the rejection"""
+        cls.rejected_sessions.set(str(session_id), (status_code, detail))
+        raise NoniAPIException(status_code=status_code, detail=detail)
+
+    @classmethod
+    def invalidate_cached_sessions(cls, session_id=None, project_id=None):
+        """Drop cached sessions by session id or by project, everything if neither is given"""
+        if session_id:
+            cls.session_cache.invalidate(str(session_id))
+        elif project_id:
+            cls.session_cache.invalidate_where(lambda key, session: session["project_id"] == int(project_id))
+        else:
+            cls.session_cache.clear()
+
+    def get_session(self, session_id, fields=None):
+        """Get session with session id, optionally only the given fields"""
+        if not session_id:
+            raise BadRequestException("No session id provided")
+        if fields and all(field in self.CACHED_SESSION_FIELDS for field in fields):
+            session = self.get_cached_session(session_id)
+            return [{field: session[field] for field in fields}] if session else []
         return self._filter_from(
             filters=[{
                 "col": "session_id",
                 "clause": "sessions_equals",
                 "value": str(session_id)
-            }]
+            }],
+            fields=fields
         )
     
     def get_valid_until(self, days_from_now, date_format="%m/%d/%Y, %H:%M:%S"):
@@ -228,22 +395,19 @@ class SessionHandler(HandlerInterface):
 
     def is_valid_session(self, session_id=None, project_id=None):
         """Check if valid session by session_id or project_id"""
-        target_col = None
-        target_value = session_id or project_id
         if session_id:
-            target_col = "session_id"
-        elif project_id:
-            target_col = "project_id"
-        if target_col and target_value:
+            return True, self.resolve_session(session_id).valid_until
+        if project_id:
             session_data = self._filter_from(
                 [{
-                    "col": target_col, 
+                    "col": "project_id", 
                     "clause": "sessions_equals", 
-                    "value": target_value
-                }]
+                    "value": project_id
+                }],
+                fields=["valid_until"]
             )
             if not len(session_data) > 0:
-                raise NotFoundException(f"{target_col}:{target_value} not found in sessions")
+                raise NotFoundException(f"project_id:{project_id} not found in sessions")
             valid_until = session_data[0]["valid_until"]
             if valid_until > datetime.now().date():
                 return True, valid_until
@@ -257,8 +421,8 @@ class SessionParticipantHandler(HandlerInterface):
     def __init__(self, db):
         super().__init__(db=db, target_model=SessionParticipantsModel)
 
-    def get_session_participants(self, session_id):
-        """Get session participants with session id"""
+    def get_session_participants(self, session_id, fields=None):
+        """Get session participants with session id, optionally only the given fields"""
         if not session_id:
             raise BadRequestException("No session id provided")
         return self._filter_from(
@@ -266,44 +430,42 @@ class SessionParticipantHandler(HandlerInterface):
                 "col": "session_uuid",
                 "clause": "session_participant_equals",
                 "value": str(session_id)
-            }]
+            }],
+            fields=fields
         )
 
     def is_participant_in_session(self, session_id, participant_id):
         """Check whether participant is in a session"""
-        participant_ids = [
-            row["participant_id"] 
-            for row in self.get_session_participants(session_id)
-            ]
-        if len(participant_ids) < 1:
+        if not (session_id and participant_id):
             return False
-        if participant_id in participant_ids:
-            return True
-        return False
+        return self.model.exists([
+            {
+                "col": "participant_id",
+                "clause": "session_participant_equals",
+                "value": int(participant_id)
+            },
+            {
+                "col": "session_uuid",
+                "clause": "session_participant_equals",
+                "value": str(session_id)
+            }
+        ])
     
     def get_session_participants_by_project_id(self, project_id):
         """Get session participants by the project id"""
         if not project_id:
-            raise BadRequestException("No project id provided")          
-        sessions_for_project = SessionHandler(self.db)._filter_from(
+            raise BadRequestException("No project id provided")
+        participants = self._filter_from(
             filters=[{
-                "col": "project_id", 
-                "clause": "sessions_equals", 
+                "col": "sessions.project_id",
+                "clause": "session_participant_equals",
                 "value": int(project_id)
-                }]
+            }],
+            format={"join": "sessions"}
         )
-        if len(sessions_for_project) > 0:
-            session_ids = tuple([row["session_id"] for row in sessions_for_project])
-            for id in session_ids:
-                return self._filter_from(
-                    filters=[{
-                        "col": "session_uuid",
-                        "clause": "session_participant_equals_in",
-                        "value": session_ids,
-                        "operator": " AND "
-                    }]
-                )  
-        raise NotFoundException(f"Sessions not found for project_id: {project_id}")
+        if not participants:
+            raise NotFoundException(f"Session participants not found for project_id: {project_id}")
+        return participants
 
     def add_session_participant(self, session_id, username):
         """Add new session participant to a existing session"""
@@ -326,15 +488,10 @@ class TaskHandler(HandlerInterface):
     def __init__(self, db):
         super().__init__(db=db,target_model=TasksModel)
 
-    def get_project_tasks_with_session_id(self, session_id):
-        if not session_id:
-            raise BadRequestException("session ID not provided")
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        project_id = session_data[0]["project_id"]
-        if not project_id:
-            raise NotFoundException(f"Project not found for session id: {session_id}")
-        return self.get_project_tasks(project_id)
+    def get_session_project_tasks(self, session: SessionContext):
+        if not session:
+            raise BadRequestException("Session not provided")
+        return self.get_project_tasks(session.project_id)
 
     def get_project_tasks(self, project_id):
         """Get tasks for project"""
@@ -348,15 +505,11 @@ class TaskHandler(HandlerInterface):
             }]
         )
 
-    def add_task_to_project(self, task_data, session_id):
+    def add_task_to_project(self, task_data, session: SessionContext):
         """Add new task to project"""
-        if not (task_data and session_id):
-            raise BadRequestException("Task data or session id not found ")
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        project_id = session_data[0]["project_id"]
-        if not project_id:
-            raise NotFoundException(f"Project not found for session id: {session_id}")
+        if not (task_data and session):
+            raise BadRequestException("Task data or session not found ")
+        project_id = session.project_id
         timestamp = datetime.now()
         success, task_id = self.add_record(
             data={
@@ -373,16 +526,33 @@ class TaskHandler(HandlerInterface):
             raise InternalServerException(f"Failed to create task for project: {project_id}. ID not returned")
         return task_id
 
-    def update_project_task(self, task_data, task_id, session_id):
+    def add_tasks_to_project(self, tasks_data, session: SessionContext):
+        """Add a batch of new tasks to project, e.g. when importing a board"""
+        if not (tasks_data and session):
+            raise BadRequestException("Task data or session not found ")
+        project_id = session.project_id
+        timestamp = datetime.now()
+        return self.add_records(
+            rows=[{
+                **task_data,
+                "project_id": int(project_id),
+                "added_at": timestamp,
+                "start_date": datetime.fromisoformat((task_data["start_date"])),
+                "end_date": datetime.fromisoformat((task_data["end_date"]))
+            } for task_data in tasks_data],
+            required_cols=["project_id", "name", "assignee", "task_type"],
+            return_col="id",
+            copy=True
+        )
+
+    def update_project_task(self, task_data, task_id, session: SessionContext):
         """Update task in project"""
-        if not (task_data and task_id and session_id):
-            raise BadRequestException("Task data or task id or session ID not found ") 
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        session_project_id = int(session_data[0]["project_id"])
+        if not (task_data and task_id and session):
+            raise BadRequestException("Task data or task id or session not found ") 
+        session_project_id = session.project_id
         if task_data["project_id"] is not None:
             provided_project_id = int(task_data["project_id"])
-            if session_project_id is not provided_project_id:
+            if session_project_id != provided_project_id:
                 raise BadRequestException("Session's project ID not matching the project id in provided task data")
         success = self.update_record(
             id=task_id,
@@ -399,16 +569,14 @@ class TaskHandler(HandlerInterface):
             }]
             )
         if not success:
-            raise InternalServerException(f"Failed to update task {task_id} for project: {project_id}")
+            raise InternalServerException(f"Failed to update task {task_id} for project: {session_project_id}")
         return task_id
 
-    def delete_task_from_project(self, task_id, session_id):
+    def delete_task_from_project(self, task_id, session: SessionContext):
         """Delete task from project"""
-        if not (task_id and session_id):
+        if not (task_id and session):
             raise BadRequestException("Task data not found ")
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        project_id = session_data[0]["project_id"]
+        project_id = session.project_id
         success = self.delete_record(
             id=task_id,
             clauses=[{"col": "id", "clause": "tasks_equals", "value": int(task_id)}]
@@ -421,30 +589,25 @@ class MessageHandler(HandlerInterface):
     def __init__(self, db):
          super().__init__(db=db,target_model=MessagesModel)
 
-    def get_project_messages(self, session_id):
-        if not session_id:
-            raise BadRequestException("session ID not provided")
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        project_id = session_data[0]["project_id"]
-        if not project_id:
-            raise NotFoundException(f"Project not found for session id: {session_id}")
-        return self._filter_from(
-            filters=[{
-                "col": "project_id",
-                "clause": "messages_equals",
-                "value": int(project_id)
-            }]
-        )    
-
-    def send_project_message(self, data, session_id):
-        if not (data and session_id):
-            raise BadRequestException("Message data or session id not found ")
-        session_handler = SessionHandler(self.db)
-        session_data = session_handler.get_session(session_id)
-        project_id = session_data[0]["project_id"]
-        if not project_id:
-            raise NotFoundException(f"Project not found for session id: {session_id}")
+    def get_project_message_filters(self, session: SessionContext):
+        if not session:
+            raise BadRequestException("Session not provided")
+        return [{
+            "col": "project_id",
+            "clause": "messages_equals",
+            "value": session.project_id
+        }]
+
+    def get_project_messages(self, session: SessionContext, limit=None, after=None):
+        filters = self.get_project_message_filters(session)
+        if limit:
+            return self._get_page(filters, limit=limit, after=after)
+        return self._filter_from(filters=filters)
+
+    def send_project_message(self, data, session: SessionContext):
+        if not (data and session):
+            raise BadRequestException("Message data or session not found ")
+        project_id = session.project_id
         timestamp = datetime.now()
         success, message_id = self.add_record(
             data={
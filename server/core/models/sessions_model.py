@@ -29,4 +29,7 @@ class SessionParticipantsModel(SQLInterface):
         self.set_clauses({
             "session_participant_equals": "{} = {}",
             "session_participant_equals_in": "{} in {}"
+        })
+        self.set_joins({
+            "sessions": ("sessions", "session_uuid", "session_id")
         })
\ No newline at end of file
@@ -1,19 +1,78 @@
 import asyncio
 import json
+import os
+from psycopg2 import sql, OperationalError, InterfaceError
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from core.utils.database import get_db
-from concurrent.futures import ThreadPoolExecutor
-import select
+from fastapi.encoders import jsonable_encoder
+from core.utils.database import get_dedicated_db, db_pool
+from core.async_sql_interface import run_in_db_connection_executor
+from core.models.projects_model import ProjectsModel
+from core.models.tasks_model import TasksModel
+from core.models.messages_model import MessagesModel
+from core.models.sessions_model import SessionParticipantsModel
+from core.utils.change_log import ChangeLog
 
 class NotificationListener():
+    """
+    One LISTEN connection per process, shared by every session room.
+    The connection's socket is registered with the event loop, so notifications are read as they arrive
+    instead of polling from a thread per channel. Subscriptions are kept per project: the project's channels
+    are LISTENed when its first session room subscribes and UNLISTENed when its last room goes away.
+    Each payload is decoded once and fanned out to every room of the project.
+
+    Triggers in id only mode (see notify_change_ids) announce just (operation, table, id), statement level triggers
+    (operation, table, ids) for every row the statement changed. Those ids are collected for a short window and
+    the rows loaded with one SELECT per table before broadcasting, in the original order.
+
+    Every broadcast change is stamped with the project's next sequence number and kept in the change log,
+    so rooms rejoining after a disconnect can be sent what they missed. The change is then encoded once
+    for every room of the project, whole row payloads are passed through as PostgreSQL sent them.
+    """
+    RECONNECT_DELAY_SECONDS = 5
+    # Grace period before the LISTEN connection of a listener with no rooms left is closed
+    IDLE_CLOSE_SECONDS = 5
+    HYDRATION_WINDOW_SECONDS = 0.02
+    # Attempts and the delay between them before a batch is given up and recorded as a gap in the change log
+    HYDRATION_ATTEMPTS = 3
+    HYDRATION_RETRY_DELAY_SECONDS = 0.2
+    # Models used to load rows announced by id -> {<table>: (<model>, <primary key>, <IN clause>)}
+    HYDRATION_MODELS = {
+        "projects": (ProjectsModel, "project_id", "projects_equals_in"),
+        "tasks": (TasksModel, "id", "tasks_equals_in"),
+        "messages": (MessagesModel, "id", "messages_equals_in"),
+        "session_participants": (SessionParticipantsModel, "participant_id", "session_participant_equals_in")
+    }
+    # Row key of the event per operation, same as the whole row payloads of notify_changes_after_insert
+    DATA_KEYS = {
+        "INSERT": "new_data",
+        "UPDATE": "updated_data",
+        "DELETE": "old_data"
+    }
+
     def __init__(self, websocket_manager):
         self.websocket_manager = websocket_manager
-        self.executor = ThreadPoolExecutor(max_workers=5)
-        self.active_tasks = {}
-        self.session_id = None
+        self.conn = None
+        self.loop = None
+        # Subscribed rooms per project, the room count is the project's reference count -> {<project_id>: {<session_id>, ...}}
+        self.project_rooms = {}
+        # Reverse lookups -> {<session_id>: <project_id>} and {<channel>: <project_id>}
+        self.room_projects = {}
+        self.channel_projects = {}
+        self._lock = asyncio.Lock()
+        self._reconnect_task = None
+        self._idle_close_handle = None
+        # Id only events waiting for their rows -> {<project_id>: [<event>, ...]}
+        self.pending_events = {}
+        # Projects whose batch is being loaded right now, later events wait for it -> {<project_id>, ...}
+        self.hydrating_projects = set()
+        # Keeps the hydration batches of a project in the order they were started, other projects don't wait for them
+        # -> {<project_id>: asyncio.Lock}
+        self.flush_locks = {}
+        # Read from environment/.env.development, loaded by core.utils.database
+        self.change_log = ChangeLog(maxlen=int(os.getenv('WEBSOCKET_CHANGE_LOG_SIZE', 1000)))
         """
         Prefixes for LISTEN/NOTIFY channels, that we will listen to for data updates.
-        When the first client joins a new session, we will add listener background tasks for each channel.
+        When the first room of a project subscribes, each channel of the project is LISTENed.
         The final channel name will be <table>_channel_<project_id>.
         """
         self.whitelisted_channels_prefixes = [
@@ -24,58 +83,272 @@ class NotificationListener():
             "session_participants_channel_"
         ]
 
-    def listen(self, channel, loop):
-        conn = get_db()
+    def get_project_channels(self, project_id):
+        return [f"{prefix}{project_id}" for prefix in self.whitelisted_channels_prefixes]
+
+    def _open_connection(self):
+        # LISTEN holds the connection for its whole lifetime -> keep it out of the pool
+        conn = get_dedicated_db()
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
-        cursor.execute(f"LISTEN {channel};")
-        print(f"Listening for messages on PostgreSQL channel '{channel}'...")
-        while True:
-            # Timeout to avoid blocking other code
-            if select.select([conn], [], [], 5.0)[0]:
-                conn.poll()
-                while conn.notifies:
-                    notify = conn.notifies.pop(0)
-                    print(f"Received PostgreSQL notification: {notify.payload}")
-                    asyncio.run_coroutine_threadsafe(
-                        self.handle_notification(notify.payload),
-                        loop
-                    )
-            else:
-                print("No notifications, continuing to poll")
-
-    async def start_up(self, project_id, session_id=None):
-        loop = asyncio.get_running_loop()
-        for prefix in self.whitelisted_channels_prefixes:
-            channel = f"{prefix}{project_id}"
-            # Need to call this in another thread, because of the blocking nature
-            future = self.executor.submit(self.listen, channel, loop)
-            self.active_tasks[channel] = future
-        if session_id:
-            self.session_id = session_id
-        loop.create_task(self.cleaner(interval_seconds=30*60))
-
-    async def handle_notification(self, message: str):
-        updated_row_json = json.loads(message)
-        await self.websocket_manager.broadcast_to_session(updated_row_json, self.session_id)
-
-    def should_cancel_channel(self, session_id):
-        participants = self.websocket_manager.active_connections.get(session_id)
-        return not participants 
-
-    async def cleaner(self, interval_seconds=3600):
-        while True:
-            print("Running task cleanup")
-            for channel, future in list(self.active_tasks.items()):
-                if future.done():
-                    print(f"Listening task for {channel} is done. Cleaning up.")
-                    del self.active_tasks[channel]
-                elif self.should_cancel_channel(self.session_id):
-                    print(f"Cancelling task for {channel}. No active clients found.")
-                    future.cancel()
-                    del self.active_tasks[channel]
-            await asyncio.sleep(interval_seconds)
-
-    def shutdown(self):
-        print("Shutting down thread pool executor.")
-        self.executor.shutdown(wait=False)
+        return conn
+
+    async def _connect(self):
+        # Connecting blocks, but the reader can only be registered from the loop thread
+        self.conn = await self.loop.run_in_executor(None, self._open_connection)
+        self.loop.add_reader(self.conn.fileno(), self._on_readable)
+        print("Opened PostgreSQL LISTEN connection")
+
+    def _close(self):
+        if self.conn is None:
+            return
+        try:
+            self.loop.remove_reader(self.conn.fileno())
+        except (ValueError, OSError, InterfaceError):
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    def _execute(self, statement, channel):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql.SQL(statement).format(sql.Identifier(channel)))
+        # Notifications received while the statement ran are queued on the connection too
+        self._drain()
+
+    async def subscribe(self, project_id, session_id):
+        """Route notifications of the project to the session room, LISTENing on the project's channels for its first room"""
+        project_id = int(project_id)
+        async with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.get_running_loop()
+            self._cancel_idle_close()
+            if self.conn is None:
+                await self._connect()
+            if not self.project_rooms.get(project_id):
+                try:
+                    for channel in self.get_project_channels(project_id):
+                        self._execute("LISTEN {}", channel)
+                        self.channel_projects[channel] = project_id
+                except Exception:
+                    # Nothing is registered for a project whose channels couldn't all be LISTENed
+                    for channel in self.get_project_channels(project_id):
+                        self.channel_projects.pop(channel, None)
+                    raise
+                self.change_log.open(project_id)
+                print(f"Listening for notifications of project {project_id}...")
+            self.project_rooms.setdefault(project_id, set()).add(session_id)
+            self.room_projects[session_id] = project_id
+
+    async def unsubscribe(self, session_id):
+        """Stop routing notifications to the session room, UNLISTENing the project's channels after its last room"""
+        async with self._lock:
+            project_id = self.room_projects.pop(session_id, None)
+            rooms = self.project_rooms.get(project_id)
+            if rooms is None:
+                return
+            rooms.discard(session_id)
+            if rooms:
+                return
+            del self.project_rooms[project_id]
+            for channel in self.get_project_channels(project_id):
+                self.channel_projects.pop(channel, None)
+                if self.conn is not None:
+                    self._execute("UNLISTEN {}", channel)
+            self.change_log.close(project_id)
+            print(f"Stopped listening for notifications of project {project_id}")
+            if not self.project_rooms:
+                self._idle_close_handle = self.loop.call_later(
+                    self.IDLE_CLOSE_SECONDS,
+                    lambda: self.loop.create_task(self.close_if_idle())
+                )
+
+    def _cancel_idle_close(self):
+        if self._idle_close_handle is not None:
+            self._idle_close_handle.cancel()
+            self._idle_close_handle = None
+
+    async def close_if_idle(self):
+        async with self._lock:
+            self._idle_close_handle = None
+            if not self.project_rooms and self.conn is not None:
+                self._close()
+                print("Closed idle PostgreSQL LISTEN connection")
+
+    def _on_readable(self):
+        try:
+            self.conn.poll()
+        except (OperationalError, InterfaceError) as e:
+            print(f"PostgreSQL LISTEN connection lost. {e}")
+            self._close()
+            if self._reconnect_task is None or self._reconnect_task.done():
+                self._reconnect_task = self.loop.create_task(self.reconnect())
+            return
+        self._drain()
+
+    def _drain(self):
+        notifies = []
+        while self.conn.notifies:
+            notifies.append(self.conn.notifies.pop(0))
+        if notifies:
+            # One task per batch keeps the notifications of a room in the order they were committed
+            self.loop.create_task(self.dispatch(notifies))
+
+    async def dispatch(self, notifies):
+        for notify in notifies:
+            print(f"Received PostgreSQL notification on {notify.channel}: {notify.payload}")
+            project_id = self.channel_projects.get(notify.channel)
+            if project_id is not None:
+                await self.handle_notification(notify.payload, project_id)
+
+    async def handle_notification(self, message: str, project_id):
+        # Decoded once, no matter how many rooms the project has. Still needed for routing, hydration and merging
+        event = json.loads(message)
+        if "ids" in event:
+            # Statement level notification -> one id only event per changed row
+            for id in event["ids"]:
+                await self.handle_event({"operation": event.get("operation"), "table": event.get("table"), "id": id}, project_id)
+            return
+        await self.handle_event(event, project_id, message)
+
+    async def handle_event(self, event, project_id, message=None):
+        pending = self.pending_events.get(project_id)
+        in_flight = project_id in self.hydrating_projects
+        if pending is None and not in_flight and not self.needs_hydration(event):
+            # Whole row payload -> sent on as is, id only DELETEs are reshaped first
+            await self.broadcast(self.to_row_event(event, {}), project_id, message if "id" not in event else None)
+            return
+        # Whole row events queue up behind pending or still loading id only events, so the room sees them in commit order
+        if pending is None:
+            pending = self.pending_events[project_id] = []
+            self.loop.call_later(
+                self.HYDRATION_WINDOW_SECONDS,
+                lambda: self.loop.create_task(self.flush_pending_events(project_id))
+            )
+        pending.append(event)
+
+    def needs_hydration(self, event):
+        return "id" in event and event.get("operation") != "DELETE"
+
+    async def flush_pending_events(self, project_id):
+        flush_lock = self.flush_locks.setdefault(project_id, asyncio.Lock())
+        async with flush_lock:
+            events = self.pending_events.pop(project_id, [])
+            self.hydrating_projects.add(project_id)
+            try:
+                rows = await self.hydrate_with_retries(events, project_id)
+                if rows is None:
+                    # Changes are lost -> replays can't cover them, reconnecting clients get a snapshot
+                    if project_id in self.project_rooms:
+                        self.change_log.open(project_id)
+                    return
+                for event in events:
+                    event = self.to_row_event(event, rows)
+                    if event is not None:
+                        await self.broadcast(event, project_id)
+            finally:
+                self.hydrating_projects.discard(project_id)
+        # No batch waiting behind this one -> the next one gets a new lock
+        if project_id not in self.pending_events and not flush_lock.locked():
+            self.flush_locks.pop(project_id, None)
+
+    async def hydrate_with_retries(self, events, project_id):
+        """Rows of the batch, None if they couldn't be loaded in HYDRATION_ATTEMPTS tries"""
+        if not any(self.needs_hydration(event) for event in events):
+            return {}
+        for attempt in range(1, self.HYDRATION_ATTEMPTS + 1):
+            try:
+                return await run_in_db_connection_executor(self.hydrate, events)
+            except Exception as e:
+                print(f"Failed to load rows for notifications of project {project_id} (attempt {attempt}). {e}")
+            if attempt < self.HYDRATION_ATTEMPTS:
+                await asyncio.sleep(self.HYDRATION_RETRY_DELAY_SECONDS)
+        return None
+
+    def hydrate(self, events):
+        """Load the rows of id only events with one SELECT per table -> {(<table>, <id>): <row>}"""
+        ids_by_table = {}
+        for event in events:
+            if self.needs_hydration(event) and event.get("table") in self.HYDRATION_MODELS:
+                ids_by_table.setdefault(event["table"], set()).add(event["id"])
+        rows = {}
+        with db_pool.connection() as db:
+            for table, ids in ids_by_table.items():
+                model, primary_key, in_clause = self.HYDRATION_MODELS[table]
+                for row in model(db).select([{"col": primary_key, "clause": in_clause, "value": tuple(ids)}]):
+                    rows[(table, row[primary_key])] = jsonable_encoder(row)
+        return rows
+
+    def to_row_event(self, event, rows):
+        """Id only event in the shape of a whole row event, None if the row is already gone"""
+        if "id" not in event:
+            return event
+        operation, table = event.get("operation"), event.get("table")
+        if operation == "DELETE":
+            primary_key = self.HYDRATION_MODELS.get(table, (None, "id"))[1]
+            row = {primary_key: event["id"]}
+        else:
+            # Deleted before it was loaded -> the DELETE event that follows covers it
+            row = rows.get((table, event["id"]))
+            if row is None:
+                return None
+        return {"operation": operation, "table": table, self.DATA_KEYS.get(operation, "data"): row}
+
+    async def broadcast(self, event, project_id, message=None):
+        seq = self.change_log.append(project_id, event)
+        rooms = list(self.project_rooms.get(project_id, ()))
+        if not rooms:
+            return
+        text = self.encode_event(event, seq, message)
+        for session_id in rooms:
+            await self.websocket_manager.broadcast_to_session(event, session_id, text)
+
+    def encode_event(self, event, seq, message=None):
+        """JSON text of the change, the original notification payload with the seq added when there is one"""
+        if message is not None:
+            # Payload is a JSON object -> the seq goes in before its closing brace
+            return f'{message[:message.rindex("}")]},"seq":{seq}}}'
+        return json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+
+    async def reconnect(self):
+        """Reopen the LISTEN connection and LISTEN again on every channel still in use"""
+        while self.conn is None and self.project_rooms:
+            await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+            async with self._lock:
+                try:
+                    await self._connect()
+                    for channel in self.channel_projects:
+                        self._execute("LISTEN {}", channel)
+                    # Changes committed while the connection was down were never seen -> can't be replayed
+                    for project_id in self.project_rooms:
+                        self.change_log.open(project_id)
+                except (OperationalError, InterfaceError) as e:
+                    print(f"Reconnecting PostgreSQL LISTEN connection failed. {e}")
+                    self._close()
+
+    def stats(self):
+        return {
+            "connected": self.conn is not None,
+            "listen_connections": 1 if self.conn is not None else 0,
+            "pending_events": sum(len(events) for events in self.pending_events.values()),
+            "hydrating_projects": len(self.hydrating_projects),
+            "projects": len(self.project_rooms),
+            "channels": len(self.channel_projects),
+            "rooms": len(self.room_projects),
+            "rooms_per_project": {project_id: len(rooms) for project_id, rooms in self.project_rooms.items()}
+        }
+
+    async def shutdown(self):
+        print("Closing PostgreSQL LISTEN connection.")
+        async with self._lock:
+            if self._reconnect_task is not None:
+                self._reconnect_task.cancel()
+            self._cancel_idle_close()
+            self.project_rooms.clear()
+            self.pending_events.clear()
+            self.hydrating_projects.clear()
+            self.flush_locks.clear()
+            self.room_projects.clear()
+            self.channel_projects.clear()
+            self._close()
@@ -1,71 +1,183 @@
 from psycopg2 import sql
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import connect
+from core.utils.query_cache import query_cache
+from core.utils.id_allocator import id_allocator
+from datetime import date, datetime
+from contextlib import contextmanager
+import itertools
+import weakref
+import re
+
+# Server side prepared statement names per connection -> {<connection>: {<query text>: <statement name>}}
+_prepared_statements = weakref.WeakKeyDictionary()
+_statement_counter = itertools.count(1)
+# Open unit of work nesting per connection -> {<connection>: <depth>}
+_transaction_depths = weakref.WeakKeyDictionary()
 
 class SQLInterface:
     """Interface for interacting with a PostgreSQL and generating dynamic queries"""
+    # Toggled from the environment config, see core.utils.database
+    use_prepared_statements = False
+
     def __init__(self, db_conn):
         self.conn = db_conn
         self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
         self.table = None
         self.columns = []
         self.clauses = {}
+        self.joins = {}
         self.autofilled_columns = []
-    
+        self.row_schema = ()
+
     def set_table(self, table):
         self.table = table
 
     def set_columns(self, columns):
         self.columns = columns
-    
+        # Expected python type per position of an insert row, checked once per row
+        self.row_schema = tuple(type for col, type in columns)
+
     def set_autofilled_columns(self, columns):
         self.autofilled_columns = columns
 
     def set_clauses(self, clauses):
         self.clauses = clauses
-    
+
+    def set_joins(self, joins):
+        # Stored in format -> {<join name>: (<joined table>, <own column>, <joined table column>)}
+        self.joins = joins
+
     def get_table(self):
         return self.table
 
     def get_columns(self):
         return self.columns
-    
+
     def get_clauses(self):
         return self.clauses
 
+    def get_joins(self):
+        return self.joins
+
     def init_db_conn(db_credentials):
         return connect(**db_credentials)
-    
-    def execute_query(self, query):
+
+    def in_transaction(self):
+        return _transaction_depths.get(self.conn, 0) > 0
+
+    def commit(self):
+        # Inside a unit of work the outermost transaction() commits once at the end
+        if not self.in_transaction():
+            self.conn.commit()
+
+    def rollback(self):
+        if not self.in_transaction():
+            self.conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work -> every statement run on this connection inside the block is committed together,
+        or rolled back together if the block raises. Nested blocks use savepoints.
+        """
+        depth = _transaction_depths.get(self.conn, 0)
+        savepoint = f"noni_savepoint_{depth}"
+        if depth > 0:
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+        _transaction_depths[self.conn] = depth + 1
         try:
-            self.cursor.execute(query)
+            yield self
+        except BaseException:
+            _transaction_depths[self.conn] = depth
+            if depth > 0:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            else:
+                print("Rolling back unit of work")
+                self.conn.rollback()
+            raise
+        _transaction_depths[self.conn] = depth
+        if depth > 0:
+            self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+        else:
             self.conn.commit()
+
+    def execute_query(self, query, values=None):
+        try:
+            if values and self.use_prepared_statements and isinstance(query, str):
+                self.execute_prepared(query, values)
+            else:
+                self.cursor.execute(query, values)
+            self.commit()
         except Exception as e:
-            print("Error executing query." + e)
-    
+            print(f"Error executing query. {e}")
+            self.rollback()
+            raise
+
+    def execute_prepared(self, query, values):
+        """Execute query through a server side prepared statement, preparing it once per connection"""
+        if any(isinstance(value, (tuple, list)) for value in values):
+            # Tuples expand to a value list client side, which can't be bound to a single $n parameter
+            self.cursor.execute(query, values)
+            return
+        statements = _prepared_statements.setdefault(self.conn, {})
+        name = statements.get(query)
+        if name is None:
+            name = f"noni_stmt_{next(_statement_counter)}"
+            counter = itertools.count(1)
+            numbered_query = re.sub(r"%s", lambda match: f"${next(counter)}", query)
+            self.cursor.execute(f"PREPARE {name} AS {numbered_query}")
+            statements[query] = name
+        placeholders = ", ".join(["%s"] * len(values))
+        self.cursor.execute(f"EXECUTE {name} ({placeholders})", values)
+
+    def compile_query(self, shape, label, build_query):
+        """Get the query text for shape from the cache, building and compiling it on a miss"""
+        return query_cache.get_or_compile(
+            shape,
+            label,
+            lambda: build_query().as_string(self.conn)
+        )
+
+    def create_nextval_block_query(self):
+        return sql.SQL("SELECT nextval({sequence}) FROM generate_series(1, {count})").format(
+            sequence=sql.Placeholder(),
+            count=sql.Placeholder()
+        )
+
     def get_next_serial_id_val(self, serial_col):
-        seq = f"{self.table}_{serial_col}_seq"
-        self.execute_query(sql.SQL("SELECT nextval({sequence})").format(
-                sequence=sql.Literal(seq)
-            ))
-        return self.cursor.fetchall()[0]["nextval"]
-    
+        # Served from a block of sequence values reserved by the process wide allocator
+        return id_allocator.take(self, serial_col)[0]
+
+    def get_next_serial_id_vals(self, serial_col, count):
+        return id_allocator.take(self, serial_col, count)
+
     def sort_row_values_by_columns(self, data):
         # Sorts keypairs to match the table col order
         return {key: data[key] for key, type in self.columns}
 
+    def get_query_params_shape(self, params):
+        """Shape of the WHERE clauses -> (col, clause, operator) for each param, values left out"""
+        return tuple(
+            (param.get("col"), param.get("clause"), param.get("operator", " AND "))
+            for param in params
+        )
+
+    def get_query_params_values(self, params):
+        return [param.get("value") for param in params if param.get("clause") in self.clauses.keys()]
+
     def create_query_params(self, params):
         query_params = []
         params_len = len(params)
         for i, param in enumerate(params):
             col = param.get("col")
             clause = param.get("clause")
-            value = param.get("value")
             operator = param.get("operator", " AND ")
             if clause in self.clauses.keys():
+                # Columns of joined tables are referenced as "<table>.<column>"
                 used_clause = sql.SQL(self.clauses.get(clause)).format(
-                    sql.Identifier(col),
-                    sql.Literal(value)
+                    sql.Identifier(*col.split(".")),
+                    sql.Placeholder()
                 )
                 query_params.append(used_clause)
             if params_len==1 or i==params_len-1:
@@ -73,97 +185,345 @@ class SQLInterface:
             query_params.append(sql.SQL(operator))
         return sql.SQL("").join(query_params)
 
-    def create_format_params(self, include_autofilled=False):
-        if include_autofilled: columns = [*self.autofilled_columns, *self.columns]
+    def get_column_names(self):
+        return [col for col, type in [*self.autofilled_columns, *self.columns]]
+
+    def create_format_params(self, include_autofilled=False, fields=None, join=None):
+        if fields: columns = [(col, None) for col in fields]
+        elif include_autofilled: columns = [*self.autofilled_columns, *self.columns]
         else: columns = [*self.columns]
+        # With a join the columns are qualified with the own table, so same named joined columns don't clash
+        qualifier = (self.table,) if join else ()
         return {
-            "columns": sql.SQL(", ").join(sql.Identifier(col) for col, type in columns),
+            "columns": sql.SQL(", ").join(sql.Identifier(*qualifier, col) for col, type in columns),
             "table": sql.Identifier(self.table)
         }
 
-    def validate_value_types(self, values):
-        for row in values:
-            for i, value in enumerate(row):
-                target_col = self.columns[i]
-                print(target_col, value)
-                if not target_col:
-                    continue
-                target_type = target_col[1]
-                if not isinstance(value, target_type):
-                    print(f"TABLE: {self.table} - Invalid type {type(value)} for col {target_col[0]}. {target_col[1]} required")
-                    return False
+    def create_join(self, join=None):
+        """JOIN clause for a join declared with set_joins"""
+        if not join:
+            return sql.SQL("")
+        if join not in self.joins:
+            raise ValueError(f"TABLE: {self.table} - unknown join: {join}")
+        joined_table, own_col, joined_col = self.joins[join]
+        return sql.SQL(" JOIN {joined_table} ON {own_col} = {joined_col}").format(
+            joined_table=sql.Identifier(joined_table),
+            own_col=sql.Identifier(self.table, own_col),
+            joined_col=sql.Identifier(joined_table, joined_col)
+        )
+
+    def validate_row(self, row):
+        if len(row) != len(self.row_schema):
+            print(f"TABLE: {self.table} - Expected {len(self.row_schema)} values, got {len(row)}")
+            return False
+        for i, (value, target_type) in enumerate(zip(row, self.row_schema)):
+            if not isinstance(value, target_type):
+                print(f"TABLE: {self.table} - Invalid type {type(value)} for col {self.columns[i][0]}. {target_type} required")
+                return False
         return True
 
-    def insert(self, values, returning=""):
-        params = self.create_format_params(include_autofilled=False)
-        values_list = []
+    def validate_value_types(self, values):
+        return all(self.validate_row(row) for row in values)
+
+    def get_invalid_rows(self, values):
+        """Indexes of the rows not matching the column types"""
+        return [i for i, row in enumerate(values) if not self.validate_row(row)]
+
+    def get_valid_rows(self, values, validated=False):
+        """Rows matching the column types, all of them if the caller already validated them"""
+        if validated:
+            return values
+        valid_rows = [row for row in values if self.validate_row(row)]
+        if len(valid_rows) < len(values):
+            print(f"TABLE: {self.table} - skipped {len(values) - len(valid_rows)} rows with invalid datatypes")
+        return valid_rows
+
+    def get_conflict_shape(self, on_conflict):
+        if not on_conflict:
+            return None
+        return (
+            tuple(on_conflict.get("cols", [])),
+            on_conflict.get("action", "nothing"),
+            tuple(on_conflict.get("update_cols", []))
+        )
+
+    def create_conflict_clause(self, on_conflict):
+        """
+        ON CONFLICT clause from {"cols": [...], "action": "nothing" | "update", "update_cols": [...]}.
+        With "update" the conflicting row is overwritten with the new values, by default every non-conflict column.
+        """
+        if not on_conflict:
+            return sql.SQL("")
+        conflict_cols = on_conflict.get("cols", [])
+        target = sql.SQL("({})").format(sql.SQL(", ").join(sql.Identifier(col) for col in conflict_cols))
+        if on_conflict.get("action", "nothing") == "nothing":
+            return sql.SQL(" ON CONFLICT {} DO NOTHING").format(target)
+        update_cols = on_conflict.get("update_cols") or [
+            col for col, type in self.columns if col not in conflict_cols
+        ]
+        return sql.SQL(" ON CONFLICT {} DO UPDATE SET {}").format(
+            target,
+            sql.SQL(", ").join(
+                sql.SQL("{col}=EXCLUDED.{col}").format(col=sql.Identifier(col)) for col in update_cols
+            )
+        )
+
+    def insert(self, values, returning="", on_conflict=None):
+        """Insert rows, returning the first new id. With on_conflict, a skipped conflicting row returns no id"""
+        valid_rows = []
         for row in values:
-            print(row)
-            if not (self.validate_value_types(values)):
+            if not self.validate_row(row):
                 print(f"TABLE: {self.table} - datatypes not valid for insert: {row}")
                 continue
-            row_sql = sql.SQL(", ").join(sql.Literal(value) for value in row)
-            values_list.append(sql.SQL("({})").format(row_sql))
-        params.update({"values": sql.SQL(", ").join(values_list)})
-        params.update({"col": sql.Identifier(returning)})
-        query = sql.SQL("INSERT INTO {table} ({columns}) values {values} RETURNING {col}").format(
-            **params
+            valid_rows.append(row)
+        def build_query():
+            params = self.create_format_params(include_autofilled=False)
+            row_sql = sql.SQL("({})").format(
+                sql.SQL(", ").join(sql.Placeholder() for col in self.columns)
+            )
+            params.update({"values": sql.SQL(", ").join(row_sql for row in valid_rows)})
+            params.update({"col": sql.Identifier(returning)})
+            params.update({"conflict": self.create_conflict_clause(on_conflict)})
+            return sql.SQL("INSERT INTO {table} ({columns}) values {values}{conflict} RETURNING {col}").format(
+                **params
+            )
+        query = self.compile_query(
+            ("insert", self.table, tuple(self.columns), len(valid_rows), returning, self.get_conflict_shape(on_conflict)),
+            f"insert:{self.table}",
+            build_query
         )
-        print("EXEUCTING:", query.as_string(self.conn))
-        self.execute_query(query)
-        id = self.cursor.fetchall()[0][returning]
+        print("EXECUTING:", query)
+        self.execute_query(query, [value for row in valid_rows for value in row])
+        rows = self.cursor.fetchall()
+        id = rows[0][returning] if rows else None
         print(id)
-        return True, self.cursor.rowcount, id
-    
-    def select(self, params, all=False):
-        if all == True:
-            all_query = sql.SQL("SELECT * FROM {table}").format(
-                table=sql.Identifier(self.table)
+        return len(rows) > 0, self.cursor.rowcount, id
+
+    def insert_many(self, values, returning="", page_size=1000, on_conflict=None, validated=False):
+        """
+        Bulk insert, sending the rows in pages of page_size with one statement per page.
+        validated skips the type check of rows the caller already checked with get_invalid_rows.
+        """
+        valid_rows = self.get_valid_rows(values, validated)
+        if not valid_rows:
+            return False, 0, []
+        query = self.compile_query(
+            ("insert_many", self.table, tuple(self.columns), returning, self.get_conflict_shape(on_conflict)),
+            f"insert_many:{self.table}",
+            lambda: sql.SQL("INSERT INTO {table} ({columns}) VALUES %s{conflict} RETURNING {col}").format(
+                **self.create_format_params(include_autofilled=False),
+                conflict=self.create_conflict_clause(on_conflict),
+                col=sql.Identifier(returning)
+            )
+        )
+        print(f"EXECUTING: {query} for {len(valid_rows)} rows")
+        try:
+            inserted = execute_values(self.cursor, query, valid_rows, page_size=page_size, fetch=True)
+            self.commit()
+        except Exception as e:
+            print(f"Error executing bulk insert. {e}")
+            self.rollback()
+            raise
+        ids = [row[returning] for row in inserted]
+        return True, len(ids), ids
+
+    def copy_many(self, values, id_col, validated=False):
+        """
+        Bulk insert through COPY. COPY can't return generated ids, so the ids are reserved up front
+        from the id allocator and written with the rows. validated works as in insert_many.
+        """
+        valid_rows = self.get_valid_rows(values, validated)
+        if not valid_rows:
+            return False, 0, []
+        ids = self.get_next_serial_id_vals(id_col, len(valid_rows))
+        query = self.compile_query(
+            ("copy", self.table, tuple(self.columns), id_col),
+            f"copy:{self.table}",
+            lambda: sql.SQL("COPY {table} ({id_col}, {columns}) FROM STDIN").format(
+                **self.create_format_params(include_autofilled=False),
+                id_col=sql.Identifier(id_col)
+            )
+        )
+        print(f"EXECUTING: {query} for {len(valid_rows)} rows")
+        try:
+            self.cursor.copy_expert(query, CopyRowStream(zip(ids, valid_rows)))
+            self.commit()
+        except Exception as e:
+            print(f"Error executing COPY. {e}")
+            self.rollback()
+            raise
+        return True, len(ids), ids
+
+    def get_primary_key(self):
+        """Column used for keyset pagination, the serial id or the first column when there is none"""
+        if self.autofilled_columns:
+            return self.autofilled_columns[0][0]
+        return self.columns[0][0]
+
+    def create_select_query(self, params, all=False, paginate=False, has_after=False, fields=None, join=None):
+        format_params = self.create_format_params(include_autofilled=True, fields=fields, join=join)
+        primary_key = sql.Identifier(*((self.table,) if join else ()), self.get_primary_key())
+        conditions = []
+        if params and not all:
+            conditions.append(sql.SQL("({})").format(self.create_query_params(params)))
+        if has_after:
+            conditions.append(sql.SQL("{} > {}").format(primary_key, sql.Placeholder()))
+        query = sql.SQL("SELECT {columns} FROM {table}{join}").format(
+            columns=sql.SQL("*") if all and not fields and not join else format_params["columns"],
+            table=format_params["table"],
+            join=self.create_join(join)
+        )
+        if conditions:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+        if paginate:
+            query += sql.SQL(" ORDER BY {} LIMIT {}").format(primary_key, sql.Placeholder())
+        return query
+
+    def get_select_query(self, params, all=False, paginate=False, has_after=False, fields=None, join=None):
+        fields = tuple(fields) if fields else ()
+        shape = () if all else self.get_query_params_shape(params)
+        verb = "select_all" if all else "select"
+        label = f"{verb}:{self.table}"
+        if join:
+            label += f"+{join}"
+        if shape:
+            label += f":{','.join(clause for col, clause, operator in shape)}"
+        return self.compile_query(
+            (verb, self.table, tuple(self.autofilled_columns), tuple(self.columns), shape, paginate, has_after, fields, join),
+            label,
+            lambda: self.create_select_query(
+                params, all=all, paginate=paginate, has_after=has_after, fields=fields, join=join
             )
-            self.execute_query(all_query)
-            return self.cursor.fetchall()
-        format_params = self.create_format_params(include_autofilled=True)
-        query_params = self.create_query_params(params)
-        format_params.update({"clauses": query_params})
-        query = sql.SQL("SELECT {columns} FROM {table} WHERE {clauses}").format(
-            **format_params
         )
-        print("EXEUCTING:", query.as_string(self.conn))
-        self.execute_query(query)
+
+    def select(self, params, all=False, limit=None, after=None, fields=None, join=None):
+        """
+        Select rows with params, or every row with all. With limit, returns one keyset page after the given key.
+        fields projects the result to the given columns, by default all of them are returned.
+        join joins a table declared with set_joins, so params can filter on its columns as "<table>.<column>".
+        """
+        paginate = limit is not None
+        has_after = paginate and after is not None
+        if fields and paginate and self.get_primary_key() not in fields:
+            # Next page cursor is built from the primary key
+            fields = [self.get_primary_key(), *fields]
+        query = self.get_select_query(params, all=all, paginate=paginate, has_after=has_after, fields=fields, join=join)
+        values = [] if all else self.get_query_params_values(params)
+        if has_after:
+            values.append(after)
+        if paginate:
+            values.append(int(limit))
+        print("EXECUTING:", query)
+        self.execute_query(query, values)
         data = self.cursor.fetchall()
         return data
-    
+
+    def stream(self, params=None, chunk_size=500, fields=None):
+        """Yield the selected rows in chunks from a server side cursor, so the whole result is never in memory"""
+        all = not params
+        query = self.get_select_query(params, all=all, fields=fields)
+        values = [] if all else self.get_query_params_values(params)
+        cursor = self.conn.cursor(name=f"noni_stream_{next(_statement_counter)}", cursor_factory=RealDictCursor)
+        cursor.itersize = chunk_size
+        try:
+            print("STREAMING:", query)
+            cursor.execute(query, values)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            # Named cursors live inside a transaction -> end it before the connection is reused
+            self.rollback()
+
     def update(self, params):
-        params.update({"clauses": self.create_query_params(params.get("clauses"))})
-        params.update({"table": sql.Identifier(self.table)})
-        columns_list = []
-        for col, value in params.get("columns").items():
-            row_sql = sql.SQL("{}={}").format(
-                sql.Identifier(col),
-                sql.Literal(value)
+        clauses = params.get("clauses")
+        columns = params.get("columns")
+        def build_query():
+            columns_list = [
+                sql.SQL("{}={}").format(sql.Identifier(col), sql.Placeholder())
+                for col in columns.keys()
+            ]
+            return sql.SQL("UPDATE {table} SET {column_values} WHERE {clauses}").format(
+                table=sql.Identifier(self.table),
+                column_values=sql.SQL(", ").join(columns_list),
+                clauses=self.create_query_params(clauses)
             )
-            columns_list.append(row_sql)
-        params.update({"column_values": sql.SQL(", ").join(columns_list)})
-        query = sql.SQL("UPDATE {table} SET {column_values} WHERE {clauses}").format(
-            **params
+        shape = self.get_query_params_shape(clauses)
+        query = self.compile_query(
+            ("update", self.table, tuple(columns.keys()), shape),
+            f"update:{self.table}:{','.join(clause for col, clause, operator in shape)}",
+            build_query
         )
-        print("EXEUCTING:", query.as_string(self.conn))
-        self.execute_query(query)
+        print("EXECUTING:", query)
+        self.execute_query(query, [*columns.values(), *self.get_query_params_values(clauses)])
         return True, self.cursor.rowcount
 
     def delete(self, params):
-        params.update({"clauses": self.create_query_params(params.get("clauses"))})
-        target_table = self.table
-        params["table"] = sql.Identifier(target_table)
-        query = sql.SQL("DELETE FROM {table} WHERE {clauses}").format(
-            **params
+        clauses = params.get("clauses")
+        def build_query():
+            return sql.SQL("DELETE FROM {table} WHERE {clauses}").format(
+                table=sql.Identifier(self.table),
+                clauses=self.create_query_params(clauses)
+            )
+        shape = self.get_query_params_shape(clauses)
+        query = self.compile_query(
+            ("delete", self.table, shape),
+            f"delete:{self.table}:{','.join(clause for col, clause, operator in shape)}",
+            build_query
         )
-        print("EXEUCTING:", query.as_string(self.conn))
-        self.execute_query(query)
+        print("EXECUTING:", query)
+        self.execute_query(query, self.get_query_params_values(clauses))
         return True, self.cursor.rowcount
 
+    def exists(self, params, join=None):
+        """Check whether any row matches params with a single EXISTS probe, without transferring the rows"""
+        def build_query():
+            return sql.SQL("SELECT EXISTS (SELECT 1 FROM {table}{join} WHERE {clauses}) AS found").format(
+                table=sql.Identifier(self.table),
+                join=self.create_join(join),
+                clauses=self.create_query_params(params)
+            )
+        shape = self.get_query_params_shape(params)
+        label = f"exists:{self.table}" + (f"+{join}" if join else "")
+        query = self.compile_query(
+            ("exists", self.table, shape, join),
+            f"{label}:{','.join(clause for col, clause, operator in shape)}",
+            build_query
+        )
+        print("EXECUTING:", query)
+        self.execute_query(query, self.get_query_params_values(params))
+        return self.cursor.fetchone()["found"]
+
     def already_exists(self, filter_params):
-        query_result = self.select(params=[{
-            **filter_params
-        }])
-        return len(query_result) > 0
\ No newline at end of file
+        return self.exists([{**filter_params}])
+
+class CopyRowStream:
+    """File-like reader that encodes (id, row) pairs to COPY text format lazily, as psycopg2 asks for data"""
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+
+    @staticmethod
+    def encode_value(value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+    def read(self, size=8192):
+        while len(self.buffer) < size:
+            try:
+                id, row = next(self.rows)
+            except StopIteration:
+                break
+            self.buffer += "\t".join(self.encode_value(value) for value in (id, *row)) + "\n"
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
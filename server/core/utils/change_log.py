@@ -0,0 +1,91 @@
+from collections import deque
+import itertools
+import threading
+import uuid
+
+class ChangeLog:
+    """
+    Per project sequence numbers and a bounded in-memory buffer of the latest changes, so reconnecting
+    websocket clients can be sent just the changes they missed. Changes are only seen while the project
+    is LISTENed on, so the buffer of a project is opened when its subscription starts and dropped when it ends.
+    Sequence numbers restart with the process, the epoch tells clients which process they were counted by.
+    """
+    def __init__(self, maxlen=1000):
+        self.maxlen = maxlen
+        self.epoch = uuid.uuid4().hex[:8]
+        # Last sequence number handed out per project, kept for the life of the process -> {<project_id>: <seq>}
+        self._seqs = {}
+        # Stored as {<project_id>: deque([<event>, ...])}, every event stamped with its "seq"
+        self._buffers = {}
+        # Sequence number from which the buffer of a project has seen every change -> {<project_id>: <seq>}
+        self._floors = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "replays": 0,
+            "replayed_events": 0,
+            "snapshots": 0
+        }
+
+    def open(self, project_id):
+        """Start recording the project's changes, anything before this can't be replayed"""
+        with self._lock:
+            # Skip a number, so clients that stopped at the last seq before the unrecorded gap get a snapshot
+            self._seqs[project_id] = self._seqs.get(project_id, 0) + 1
+            self._buffers[project_id] = deque(maxlen=self.maxlen)
+            self._floors[project_id] = self._seqs[project_id]
+
+    def close(self, project_id):
+        with self._lock:
+            self._buffers.pop(project_id, None)
+            self._floors.pop(project_id, None)
+
+    def append(self, project_id, event):
+        """Stamp the event with the project's next sequence number and record it"""
+        with self._lock:
+            seq = self._seqs.get(project_id, 0) + 1
+            self._seqs[project_id] = seq
+            event["seq"] = seq
+            buffer = self._buffers.get(project_id)
+            if buffer is not None:
+                buffer.append(event)
+            return seq
+
+    def last_seq(self, project_id):
+        with self._lock:
+            return self._seqs.get(project_id, 0)
+
+    def since(self, project_id, seq, epoch=None):
+        """Changes of the project after seq, or None if they can't all be replayed and a snapshot is needed"""
+        with self._lock:
+            buffer = self._buffers.get(project_id)
+            replayable = (
+                buffer is not None
+                and epoch == self.epoch
+                and self._floors[project_id] <= seq <= self._seqs.get(project_id, 0)
+                # Rolled over -> the oldest change still buffered is newer than the first one missed
+                and not (buffer and buffer[0]["seq"] > seq + 1)
+            )
+            if not replayable:
+                return None
+            return list(itertools.dropwhile(lambda event: event["seq"] <= seq, buffer))
+
+    def record_replay(self, events):
+        with self._lock:
+            self._counters["replays"] += 1
+            self._counters["replayed_events"] += events
+
+    def record_snapshot(self):
+        with self._lock:
+            self._counters["snapshots"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "epoch": self.epoch,
+                "maxlen": self.maxlen,
+                "projects": {
+                    project_id: {"seq": self._seqs.get(project_id, 0), "buffered": len(buffer)}
+                    for project_id, buffer in self._buffers.items()
+                },
+                **self._counters
+            }
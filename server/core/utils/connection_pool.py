@@ -0,0 +1,159 @@
+from psycopg2 import extensions
+from contextlib import contextmanager
+from core.utils.exceptions import ServiceUnavailableException
+import threading
+import time
+
+class ConnectionPool:
+    """Bounded, health-checked pool of PostgreSQL connections shared by the API workers"""
+    def __init__(self, connect, max_size=10, timeout=5.0, max_waiting=20, health_check_interval=30.0):
+        # connect -> callable returning a new psycopg2 connection
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.health_check_interval = health_check_interval
+        # Idle connections stored as (connection, last_used_monotonic)
+        self._idle = []
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._counters = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "wait_seconds_total": 0.0
+        }
+
+    def _reserve(self):
+        """Take an idle connection or a free slot, waiting in the bounded queue if saturated"""
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ServiceUnavailableException("Database connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                if self._waiting >= self.max_waiting:
+                    self._counters["rejected"] += 1
+                    raise ServiceUnavailableException("Database connection pool saturated")
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise ServiceUnavailableException("Timed out waiting for a database connection")
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._counters["checkouts"] += 1
+            self._counters["wait_seconds_total"] += time.monotonic() - started
+        return conn, last_used
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _open(self):
+        conn = self._connect()
+        with self._condition:
+            self._counters["created"] += 1
+        return conn
+
+    def _close(self, conn):
+        with self._condition:
+            self._counters["discarded"] += 1
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing pooled connection: {e}")
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        # Connection has been idle for a while -> make sure the server side is still there
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            print(f"Pooled connection failed health check: {e}")
+            return False
+
+    def getconn(self):
+        """Check out a connection from the pool"""
+        conn, last_used = self._reserve()
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._release_slot()
+            raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back anything left open"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception as e:
+                print(f"Rollback failed while returning connection to pool: {e}")
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._close(conn)
+            self._release_slot()
+            return
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager for code outside the FastAPI dependency graph"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """Current pool usage and saturation counters"""
+        with self._condition:
+            in_use = self._size - len(self._idle)
+            return {
+                "max_size": self.max_size,
+                "max_waiting": self.max_waiting,
+                "timeout": self.timeout,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "waiting": self._waiting,
+                "saturation": in_use / self.max_size if self.max_size else 0.0,
+                **self._counters
+            }
+
+    def close(self):
+        """Close all idle connections and refuse new checkouts"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for conn, last_used in idle:
+            self._close(conn)
@@ -1,4 +1,6 @@
 from core.sql_interface import SQLInterface
+from core.utils.connection_pool import ConnectionPool
+from core.utils.id_allocator import id_allocator
 from dotenv import load_dotenv
 import os
 
@@ -12,5 +14,40 @@ POSTGRE_CREDENTIALS = {
     "database": os.getenv('POSTGRE_DATABASE')
 }
 
+POSTGRE_POOL_SETTINGS = {
+    "max_size": int(os.getenv('POSTGRE_POOL_MAX_SIZE', 10)),
+    "timeout": float(os.getenv('POSTGRE_POOL_TIMEOUT', 5)),
+    "max_waiting": int(os.getenv('POSTGRE_POOL_MAX_WAITING', 20)),
+    "health_check_interval": float(os.getenv('POSTGRE_POOL_HEALTH_CHECK_INTERVAL', 30))
+}
+
+# Bind query values through server side prepared statements instead of client side interpolation
+SQLInterface.use_prepared_statements = os.getenv('POSTGRE_PREPARED_STATEMENTS', 'false').lower() == 'true'
+
+# Serial ids reserved per sequence round trip, e.g. POSTGRE_ID_BLOCK_SIZES=tasks=500,messages=50
+id_allocator.configure(
+    default_block_size=int(os.getenv('POSTGRE_ID_BLOCK_SIZE', 50)),
+    block_sizes={
+        table.strip(): int(size)
+        for table, size in (
+            entry.split("=") for entry in os.getenv('POSTGRE_ID_BLOCK_SIZES', '').split(",") if "=" in entry
+        )
+    }
+)
+
+db_pool = ConnectionPool(
+    connect=lambda: SQLInterface.init_db_conn(POSTGRE_CREDENTIALS),
+    **POSTGRE_POOL_SETTINGS
+)
+
 def get_db():
-    return SQLInterface.init_db_conn(POSTGRE_CREDENTIALS)
\ No newline at end of file
+    """FastAPI dependency yielding a pooled connection, handed back to the pool after the request"""
+    conn = db_pool.getconn()
+    try:
+        yield conn
+    finally:
+        db_pool.putconn(conn)
+
+def get_dedicated_db():
+    """Open a connection outside the pool, for long lived users like LISTEN loops"""
+    return SQLInterface.init_db_conn(POSTGRE_CREDENTIALS)
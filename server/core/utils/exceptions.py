@@ -35,4 +35,8 @@ class ConflictException(NoniAPIException):
 
 class InternalServerException(NoniAPIException):
     def __init__(self, detail: str = "Internal Server Error"):
-        super().__init__(status_code=500, detail=detail)
\ No newline at end of file
+        super().__init__(status_code=500, detail=detail)
+
+class ServiceUnavailableException(NoniAPIException):
+    def __init__(self, detail: str = "Service Unavailable"):
+        super().__init__(status_code=503, detail=detail)
\ No newline at end of file
@@ -0,0 +1,80 @@
+from collections import deque
+import threading
+import time
+
+class IdAllocator:
+    """
+    Per process hi/lo allocator for serial ids. Sequence values are reserved in blocks with a single
+    SELECT nextval(...) FROM generate_series(...) round trip and then handed out from memory.
+    Reserved values that are never used (e.g. on restart) just leave gaps in the ids.
+    """
+    def __init__(self, default_block_size=50, block_sizes=None):
+        self.default_block_size = default_block_size
+        # Block size per table -> {<table>: <size>}
+        self.block_sizes = block_sizes or {}
+        self._blocks = {}
+        self._locks = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def configure(self, default_block_size=None, block_sizes=None):
+        if default_block_size:
+            self.default_block_size = default_block_size
+        if block_sizes:
+            self.block_sizes.update(block_sizes)
+
+    def get_block_size(self, table):
+        return self.block_sizes.get(table, self.default_block_size)
+
+    def _get_sequence_state(self, sequence):
+        with self._lock:
+            if sequence not in self._blocks:
+                self._blocks[sequence] = deque()
+                self._locks[sequence] = threading.Lock()
+                self._stats[sequence] = {
+                    "refills": 0,
+                    "reserved": 0,
+                    "handed_out": 0,
+                    "last_refill_at": None,
+                    "refill_seconds_total": 0.0
+                }
+            return self._blocks[sequence], self._locks[sequence], self._stats[sequence]
+
+    def _refill(self, model, sequence, count, stats):
+        started = time.monotonic()
+        query = model.compile_query(
+            ("nextval_block",),
+            "nextval_block",
+            lambda: model.create_nextval_block_query()
+        )
+        model.execute_query(query, [sequence, count])
+        ids = [row["nextval"] for row in model.cursor.fetchall()]
+        stats["refills"] += 1
+        stats["reserved"] += len(ids)
+        stats["last_refill_at"] = time.time()
+        stats["refill_seconds_total"] += time.monotonic() - started
+        return ids
+
+    def take(self, model, serial_col, count=1):
+        """Hand out count ids for model.table's serial_col, refilling the block from the sequence when it runs dry"""
+        sequence = f"{model.table}_{serial_col}_seq"
+        block, lock, stats = self._get_sequence_state(sequence)
+        with lock:
+            missing = count - len(block)
+            if missing > 0:
+                block.extend(self._refill(model, sequence, max(missing, self.get_block_size(model.table)), stats))
+            stats["handed_out"] += count
+            return [block.popleft() for i in range(count)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "default_block_size": self.default_block_size,
+                "block_sizes": dict(self.block_sizes),
+                "sequences": {
+                    sequence: {**stats, "available": len(self._blocks[sequence])}
+                    for sequence, stats in self._stats.items()
+                }
+            }
+
+id_allocator = IdAllocator()
@@ -0,0 +1,42 @@
+from core.utils.exceptions import BadRequestException
+from datetime import date, datetime
+from decimal import Decimal
+import base64
+import json
+
+"""
+Keyset pagination helpers. The `after` cursor handed to clients is the last primary key of a page,
+wrapped in base64 so that clients treat it as opaque and don't start building their own.
+"""
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"k": key}).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))["k"]
+    except (ValueError, KeyError, TypeError):
+        raise BadRequestException("Invalid pagination cursor")
+
+def create_page(rows: list, key_col: str, limit: int) -> dict:
+    """
+    Wrap a page of rows with the cursor for the next page, None when this was the last one.
+    rows is selected with limit + 1, the extra row is only there to tell whether a next page exists.
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][key_col])
+    return {"items": rows, "next_cursor": next_cursor}
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def to_ndjson(chunks):
+    """Turn chunks of rows into newline delimited JSON lines, one chunk at a time"""
+    for rows in chunks:
+        yield "".join(json.dumps(row, default=_json_default) + "\n" for row in rows)
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import threading
+
+class QueryCache:
+    """
+    Process wide LRU cache of compiled query texts, keyed by query shape.
+    Filter shapes come from request bodies, so both the texts and the per shape counters are bounded.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        # Least recently used first
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Hit/miss counts per <verb>:<table>[:<clauses>] label, labels past maxsize are counted as "other"
+        self.per_shape = {}
+
+    def get_or_compile(self, shape, label, compile):
+        """Return the cached query text for shape, calling compile() on the first use"""
+        with self._lock:
+            text = self._queries.get(shape)
+            if label not in self.per_shape and len(self.per_shape) >= self.maxsize:
+                label = "other"
+            counters = self.per_shape.setdefault(label, {"hits": 0, "misses": 0})
+            if text is not None:
+                self._queries.move_to_end(shape)
+                self.hits += 1
+                counters["hits"] += 1
+                return text
+            self.misses += 1
+            counters["misses"] += 1
+        # Compile outside the lock, a racing duplicate compile produces the same text anyway
+        text = compile()
+        with self._lock:
+            self._queries[shape] = text
+            self._queries.move_to_end(shape)
+            while len(self._queries) > self.maxsize:
+                self._queries.popitem(last=False)
+                self.evictions += 1
+        return text
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._queries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "per_shape": {label: dict(counters) for label, counters in self.per_shape.items()}
+            }
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+
+query_cache = QueryCache()
@@ -0,0 +1,84 @@
+import os
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import Frame, Opcode
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+import core.utils.database  # Loads environment/.env.development
+
+# Read from environment/.env.development. Window bits 9-15 and memory level 1-9 trade memory per connection for ratio
+WEBSOCKET_COMPRESSION_SETTINGS = {
+    "enabled": os.getenv('WEBSOCKET_COMPRESSION', 'true').lower() == 'true',
+    "window_bits": int(os.getenv('WEBSOCKET_COMPRESSION_WINDOW_BITS', 12)),
+    "memory_level": int(os.getenv('WEBSOCKET_COMPRESSION_MEMORY_LEVEL', 5)),
+    "min_size": int(os.getenv('WEBSOCKET_COMPRESSION_MIN_SIZE', 64))
+}
+
+# Shared by every connection of the process
+compression_counters = {
+    "compressed_frames": 0,
+    "uncompressed_frames": 0,
+    "bytes_in": 0,
+    "bytes_out": 0
+}
+
+class MinSizePerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends messages smaller than min_size uncompressed, for tiny frames the deflate
+    call costs more than the few bytes it saves. RFC 7692 leaves compressing to the sender per message,
+    the RSV1 bit tells the other side which ones are.
+    """
+    def __init__(self, *args, min_size=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame: Frame) -> Frame:
+        # Only whole messages can be skipped, a fragmented one has to be compressed from its first frame on
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY) and frame.fin and len(frame.data) < self.min_size:
+            compression_counters["uncompressed_frames"] += 1
+            return frame
+        encoded = super().encode(frame)
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY):
+            compression_counters["compressed_frames"] += 1
+            compression_counters["bytes_in"] += len(frame.data)
+            compression_counters["bytes_out"] += len(encoded.data)
+        return encoded
+
+class ServerCompressionFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate with the configured window bits, memory level and minimum size"""
+    def __init__(self, window_bits=15, memory_level=8, min_size=0):
+        super().__init__(
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+            compress_settings={"memLevel": memory_level}
+        )
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, MinSizePerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size
+        )
+
+class CompressedWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn's websockets protocol with tunable compression, pass it as ws= to uvicorn.run.
+    Plain uvicorn (and fastapi dev) only knows on/off, with zlib's defaults.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        settings = WEBSOCKET_COMPRESSION_SETTINGS
+        self.available_extensions = [
+            ServerCompressionFactory(settings["window_bits"], settings["memory_level"], settings["min_size"])
+        ] if settings["enabled"] else []
+
+def compression_stats():
+    compressed_in = compression_counters["bytes_in"]
+    return {
+        **WEBSOCKET_COMPRESSION_SETTINGS,
+        **compression_counters,
+        "ratio": compression_counters["bytes_out"] / compressed_in if compressed_in else 0.0
+    }
@@ -1,37 +1,263 @@
 from fastapi import WebSocket
 from typing import Dict
+from collections import OrderedDict
+import asyncio
+import itertools
+import json
+import os
+import msgpack
+from fastapi.encoders import jsonable_encoder
 from core.notification_listener import NotificationListener
-from core.utils.database import get_db
-from core.handlers import SessionHandler, SessionParticipantHandler
+from core.utils.database import db_pool
+from core.handlers import SessionHandler, SessionParticipantHandler, TaskHandler, MessageHandler, ProjectHandler
+from core.async_sql_interface import run_in_db_connection_executor
+from core.utils.exceptions import NoniAPIException
+
+# Read from environment/.env.development, loaded by core.utils.database. A window of 0 sends every change as its own frame
+WEBSOCKET_COALESCE_SETTINGS = {
+    "window_ms": float(os.getenv('WEBSOCKET_COALESCE_WINDOW_MS', 25)),
+    "max_batch": int(os.getenv('WEBSOCKET_COALESCE_MAX_BATCH', 100))
+}
+# Frames a client may have waiting before it's dropped, and how long one frame may take to send
+WEBSOCKET_SEND_SETTINGS = {
+    "queue_size": int(os.getenv('WEBSOCKET_SEND_QUEUE_SIZE', 256)),
+    "timeout_ms": float(os.getenv('WEBSOCKET_SEND_TIMEOUT_MS', 5000))
+}
+# How long a dropped client keeps its session participant to reconnect with, a normal close leaves right away
+WEBSOCKET_RECONNECT_SETTINGS = {
+    "grace_ms": float(os.getenv('WEBSOCKET_RECONNECT_GRACE_MS', 60000))
+}
+
+class ClientOutbox:
+    """
+    Bounded queue of outgoing frames of one websocket client, sent by its own writer task,
+    so a client on a slow link only holds up itself. Frames are queued already encoded in the client's encoding:
+    text is sent as a text frame, bytes as a binary frame.
+    """
+    def __init__(self, websocket: WebSocket, session_id, participant_id, maxsize, send_timeout, on_evict, encoding="json"):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.participant_id = participant_id
+        self.encoding = encoding
+        self.send_timeout = send_timeout
+        self.on_evict = on_evict
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.sent = 0
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, message):
+        """Queue the frame without waiting for it to be sent, False if the queue is full"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        while True:
+            message = await self.queue.get()
+            send = self.websocket.send_bytes if isinstance(message, bytes) else self.websocket.send_text
+            try:
+                await asyncio.wait_for(send(message), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                # Evicted from its own task, so the writer isn't cancelled halfway through the eviction
+                asyncio.get_running_loop().create_task(self.on_evict(self, "timeout"))
+                return
+            except Exception as e:
+                # Connection is gone -> the endpoint's receive loop sees it too and disconnects the client
+                print(f"Error sending to #{self.participant_id} of session {self.session_id}. {e}")
+                return
+            self.sent += 1
+
+    def close(self):
+        self.task.cancel()
 
 class WebsocketManager:
-    def __init__(self):
+    # Primary key per table, used to deduplicate changes to the same row. Tables not listed use "id"
+    PRIMARY_KEYS = {
+        "projects": "project_id",
+        "session_participants": "participant_id"
+    }
+    # Snapshots read before the log of the project lost changes again, after that the join fails
+    SYNC_ATTEMPTS = 3
+    DATA_KEYS = ("new_data", "updated_data", "old_data")
+    # Change frame encodings a client can ask for with a subprotocol or ?encoding=, JSON if it asks for none
+    ENCODINGS = ("json", "msgpack")
+    SUBPROTOCOLS = {
+        "noni.json": "json",
+        "noni.msgpack": "msgpack"
+    }
+
+    def __init__(self, coalesce_window_ms=None, coalesce_max_batch=None):
         # Stored in format -> {<session_id>: {<participant_id>: WebSocket}}
         self.active_connections : Dict[str, Dict[str, WebSocket]] = {}
-        self.session_handler = SessionHandler(get_db())
-        self.session_participant_handler = SessionParticipantHandler(get_db())
+        self.coalesce_window_seconds = (
+            WEBSOCKET_COALESCE_SETTINGS["window_ms"] if coalesce_window_ms is None else coalesce_window_ms
+        ) / 1000
+        self.coalesce_max_batch = coalesce_max_batch or WEBSOCKET_COALESCE_SETTINGS["max_batch"]
+        # Changes waiting for the next frame of a room, with their JSON text if already encoded
+        # -> {<session_id>: OrderedDict({<row key>: (<event>, <text>)})}
+        self.pending_frames = {}
+        self.flush_handles = {}
+        # Keeps the frames of a room in order while they are sent
+        self.send_locks = {}
+        # Outgoing frames per client -> {<WebSocket>: ClientOutbox}
+        self.outboxes = {}
+        self.send_queue_size = WEBSOCKET_SEND_SETTINGS["queue_size"]
+        self.send_timeout_seconds = WEBSOCKET_SEND_SETTINGS["timeout_ms"] / 1000
+        self.reconnect_grace_seconds = WEBSOCKET_RECONNECT_SETTINGS["grace_ms"] / 1000
+        # Participants of dropped clients waiting to be removed -> {<participant_id>: TimerHandle}
+        self.pending_removals = {}
+        self._unkeyed = itertools.count()
+        self.counters = {
+            "events": 0,
+            "deduplicated": 0,
+            "frames": 0,
+            "evicted_overflow": 0,
+            "evicted_timeout": 0,
+            "reconnected_participants": 0,
+            "removed_participants": 0
+        }
+        # Single LISTEN connection shared by all rooms of this process
+        self.notification_listener = NotificationListener(websocket_manager=self)
 
-    async def connect(self, websocket: WebSocket, session_id: str, participant_id: int):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, session_id: str, participant_id: int, since=None, epoch=None, encoding=None):
+        """
+        Join the session room. The client is first sent where it stands in the project's change log:
+        the changes it missed since its last seen sequence number, or a snapshot if they can't be replayed.
+        """
+        encoding, subprotocol = self.negotiate_encoding(websocket, encoding)
+        await websocket.accept(subprotocol=subprotocol)
         if not (session_id and participant_id):
             await websocket.send_text(f"Session ID or participant ID not found in path, byebye")
             await websocket.close(code=1000)
-        if session_id not in self.active_connections:
-            project_id = self.session_handler.get_session(session_id=session_id)[0]["project_id"]
-            if not project_id:
-                await websocket.send_text(f"Project ID not found for session ID: {session_id}, byebye")
-                await websocket.close(code=1000)
-            self.active_connections[session_id] = {}
-            notification_listener = NotificationListener(
-                websocket_manager=self
-            )
-            await notification_listener.start_up(project_id, session_id=session_id)
-        self.active_connections[session_id][str(participant_id)] = websocket
+            return False
+        try:
+            project_id = await self.subscribe_room(session_id)
+        except NoniAPIException as e:
+            # Unknown or expired session
+            await websocket.send_text(f"{e.detail['error']}, byebye")
+            await websocket.close(code=1008)
+            return False
+        except Exception as e:
+            print(f"Failed to subscribe session {session_id} to notifications. {e}")
+            await websocket.close(code=1011)
+            return False
+        if not project_id:
+            await websocket.send_text(f"Project ID not found for session ID: {session_id}, byebye")
+            await websocket.close(code=1008)
+            return False
+        change_log = self.notification_listener.change_log
+        synced = False
+        try:
+            needs_snapshot = since is not None and change_log.since(project_id, since, epoch) is None
+            for attempt in range(self.SYNC_ATTEMPTS):
+                # Read before joining, the room's frames would otherwise wait for the database
+                snapshot = await self.load_snapshot(session_id, project_id) if needs_snapshot else None
+                # The room's last client may have left meanwhile, taking the subscription with it
+                await self.subscribe_room(session_id)
+                # Joins between frames of the room, so every change after the sync point reaches it in a frame
+                async with self.send_locks.setdefault(session_id, asyncio.Lock()):
+                    subscribed = session_id in self.notification_listener.room_projects
+                    frames = self.get_sync_frames(session_id, project_id, since, epoch, snapshot) if subscribed else None
+                    if frames is not None:
+                        if self.keep_participant(str(participant_id)):
+                            self.counters["reconnected_participants"] += 1
+                        self.active_connections.setdefault(session_id, {})[str(participant_id)] = websocket
+                        self.outboxes[websocket] = ClientOutbox(
+                            websocket, session_id, str(participant_id), self.send_queue_size,
+                            self.send_timeout_seconds, self.evict, encoding
+                        )
+                        for frame in frames:
+                            self.send_to_client(websocket, frame)
+                        synced = True
+                        break
+                # The project's log lost changes since the check or the snapshot read -> read a new snapshot
+                needs_snapshot = True
+        except Exception as e:
+            print(f"Failed to sync #{participant_id} of session {session_id}. {e}")
+        if not synced:
+            await websocket.close(code=1011)
+            await self.disconnect(session_id, websocket)
+            if session_id not in self.active_connections:
+                # Subscribed for this client only, no room to release it with
+                await self.notification_listener.unsubscribe(session_id)
+            return False
         print(f"#{participant_id} joined session {session_id} room")
         print(f"Current users in that room: {list(self.active_connections[session_id].keys())}")
         print(f"\nAll rooms and users {self.active_connections}")
+        return True
+
+    def negotiate_encoding(self, websocket: WebSocket, encoding=None):
+        """Encoding of the client's change frames and the subprotocol to accept -> (<encoding>, <subprotocol>)"""
+        for subprotocol in websocket.scope.get("subprotocols", []):
+            if subprotocol in self.SUBPROTOCOLS:
+                return self.SUBPROTOCOLS[subprotocol], subprotocol
+        return (encoding if encoding in self.ENCODINGS else "json"), None
+
+    async def subscribe_room(self, session_id):
+        """Project of the session room, subscribing the room to its notifications if it isn't yet"""
+        project_id = self.notification_listener.room_projects.get(session_id)
+        # Also for a client joining while the room's first client is still subscribing, subscribe() waits for it
+        if project_id is None:
+            project_id = await run_in_db_connection_executor(self.get_session_project_id, session_id)
+            if not project_id:
+                return None
+            # The room itself is only created when its first client joins it
+            await self.notification_listener.subscribe(project_id, session_id)
+        return int(project_id)
+
+    async def load_snapshot(self, session_id, project_id):
+        """Project state for a client whose missed changes can't be replayed -> (<seq>, <snapshot_data>)"""
+        # Taken before the read, changes racing the snapshot are sent again and skipped or reapplied by the client
+        seq = self.notification_listener.change_log.last_seq(project_id)
+        return seq, await run_in_db_connection_executor(self.get_project_snapshot, session_id)
 
-    def disconnect(self, session_id: str,  websocket: WebSocket):
+    def get_sync_frames(self, session_id, project_id, since=None, epoch=None, snapshot=None):
+        """
+        Frames that bring a joining client up to the room's next frame, None if the change log can't cover them.
+        Doesn't wait, it runs while the room's frames are held back.
+        """
+        change_log = self.notification_listener.change_log
+        if since is None:
+            # Fresh client -> it loads the project itself, just tell it where the log stands
+            return [{"operation": "SYNC", "epoch": change_log.epoch, "seq": change_log.last_seq(project_id)}]
+        if snapshot is None:
+            missed = change_log.since(project_id, since, epoch)
+            if missed is None:
+                return None
+            print(f"Replaying {len(missed)} changes of project {project_id} to session {session_id}")
+            change_log.record_replay(len(missed))
+            return [missed] if missed else []
+        seq, snapshot_data = snapshot
+        # Changes broadcast while the snapshot was read went out before the client joined the room
+        missed = change_log.since(project_id, seq, change_log.epoch)
+        if missed is None:
+            return None
+        print(f"Sending snapshot of project {project_id} to session {session_id}")
+        change_log.record_snapshot()
+        frames = [{"operation": "SNAPSHOT", "epoch": change_log.epoch, "seq": seq, "snapshot_data": snapshot_data}]
+        return frames + [missed] if missed else frames
+
+    def get_project_snapshot(self, session_id: str):
+        """Current tasks, messages and participants of the session's project, as the client loads them on start"""
+        with db_pool.connection() as db:
+            session = SessionHandler(db).resolve_session(session_id)
+            return jsonable_encoder({
+                "tasks": TaskHandler(db).get_project_tasks(session.project_id),
+                "messages": MessageHandler(db).get_project_messages(session),
+                "participants": ProjectHandler(db).get_project_participants(session)
+            })
+
+    def get_session_project_id(self, session_id: str):
+        with db_pool.connection() as db:
+            return SessionHandler(db).resolve_session(session_id).project_id
+
+    async def disconnect(self, session_id: str,  websocket: WebSocket, leave=False):
+        """
+        Remove the client from its room. Its session participant is removed right away only when it left (leave=True),
+        a dropped or evicted client keeps it for reconnect_grace_seconds to reconnect with.
+        """
         if session_id in self.active_connections:
             session_participants = self.active_connections[session_id]
             participant_id_to_remove = None
@@ -39,21 +265,138 @@ class WebsocketManager:
                 if ws == websocket:
                     participant_id_to_remove = participant_id
                     break
+            outbox = self.outboxes.pop(websocket, None)
+            if outbox is not None:
+                outbox.close()
             if participant_id_to_remove is not None:
                 del session_participants[participant_id_to_remove]
                 print(f"#{participant_id_to_remove} disconnected from session {session_id}")
             if not session_participants:
+                # Last one out -> UNLISTEN right away, the listener closes its connection once no room needs it
                 del self.active_connections[session_id]
-            self.session_participant_handler.delete_record(
-                    id=participant_id_to_remove,
-                    clauses=[{
-                        "col": "participant_id", 
-                        "clause": "session_participant_equals", 
-                        "value": int(participant_id_to_remove)
-                        }]
-                )            
-
-    async def broadcast_to_session(self, message, session_id):
+                self.drop_pending_frame(session_id)
+                await self.notification_listener.unsubscribe(session_id)
+            if participant_id_to_remove is not None:
+                if leave or self.reconnect_grace_seconds <= 0:
+                    self.keep_participant(participant_id_to_remove)
+                    await self.expire_participant(participant_id_to_remove)
+                else:
+                    self.schedule_participant_removal(participant_id_to_remove)
+
+    def schedule_participant_removal(self, participant_id):
+        self.keep_participant(participant_id)
+        loop = asyncio.get_running_loop()
+        self.pending_removals[participant_id] = loop.call_later(
+            self.reconnect_grace_seconds,
+            lambda: loop.create_task(self.expire_participant(participant_id))
+        )
+
+    def keep_participant(self, participant_id):
+        """Cancel the pending removal of the participant, False if none was pending"""
+        handle = self.pending_removals.pop(participant_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def is_connected(self, participant_id):
+        return any(participant_id in session_participants for session_participants in self.active_connections.values())
+
+    async def expire_participant(self, participant_id):
+        self.pending_removals.pop(participant_id, None)
+        # Reconnected meanwhile, with its removal already on its way
+        if self.is_connected(participant_id):
+            return
+        try:
+            await run_in_db_connection_executor(self.remove_session_participant, participant_id)
+            self.counters["removed_participants"] += 1
+        except Exception as e:
+            print(f"Failed to remove participant #{participant_id}. {e}")
+
+    def remove_session_participant(self, participant_id):
+        with db_pool.connection() as db:
+            SessionParticipantHandler(db).delete_record(
+                id=participant_id,
+                clauses=[{
+                    "col": "participant_id", 
+                    "clause": "session_participant_equals", 
+                    "value": int(participant_id)
+                    }]
+            )
+
+    async def broadcast_to_session(self, message, session_id, text=None):
+        """
+        Send a change to every member of the room. With a coalescing window the changes are collected for
+        the window and sent as one array frame, max coalesce_max_batch changes per frame. Repeated changes
+        to the same row within a frame are merged into the latest version.
+        text is the change already encoded as JSON, shared by every room it goes to.
+        """
+        if session_id not in self.active_connections:
+            print(f"No session id of: {session_id} found for broadcasting")
+            return False
+        if self.coalesce_window_seconds <= 0:
+            async with self.send_locks.setdefault(session_id, asyncio.Lock()):
+                return await self.send_to_session(message, session_id, text)
+        self.counters["events"] += 1
+        frame = self.pending_frames.setdefault(session_id, OrderedDict())
+        self.add_to_frame(frame, message, text)
+        if len(frame) >= self.coalesce_max_batch:
+            await self.flush_frame(session_id)
+        elif session_id not in self.flush_handles:
+            loop = asyncio.get_running_loop()
+            self.flush_handles[session_id] = loop.call_later(
+                self.coalesce_window_seconds,
+                lambda: loop.create_task(self.flush_frame(session_id))
+            )
+        return True
+
+    def get_row_key(self, event):
+        table = event.get("table")
+        primary_key = self.PRIMARY_KEYS.get(table, "id")
+        for data_key in self.DATA_KEYS:
+            row = event.get(data_key)
+            if isinstance(row, dict) and row.get(primary_key) is not None:
+                return (table, row[primary_key])
+        return ("unkeyed", next(self._unkeyed))
+
+    def add_to_frame(self, frame, event, text=None):
+        """Add event to the frame, merging it with an earlier change to the same row"""
+        key = self.get_row_key(event)
+        previous, _ = frame.pop(key, (None, None))
+        if previous is not None:
+            self.counters["deduplicated"] += 1
+            operation = event.get("operation")
+            if previous.get("operation") == "INSERT":
+                if operation == "DELETE":
+                    # Client never saw the row -> nothing to send
+                    return
+                if operation == "UPDATE":
+                    # Client hasn't seen the row yet, so it's still an insert, of the latest version
+                    event = {
+                        "operation": "INSERT",
+                        "table": event.get("table"),
+                        "new_data": event.get("updated_data"),
+                        "seq": event.get("seq")
+                    }
+                    text = None
+        frame[key] = (event, text)
+
+    async def flush_frame(self, session_id):
+        handle = self.flush_handles.pop(session_id, None)
+        if handle is not None:
+            handle.cancel()
+        frame = self.pending_frames.pop(session_id, None)
+        if not frame:
+            return
+        self.counters["frames"] += 1
+        events = [event for event, text in frame.values()]
+        # Changes encoded by the listener are joined as they are, only merged ones are encoded here
+        payload = "[" + ",".join(self.encode(event) if text is None else text for event, text in frame.values()) + "]"
+        async with self.send_locks.setdefault(session_id, asyncio.Lock()):
+            await self.send_to_session(events, session_id, payload)
+
+    async def send_to_session(self, message, session_id, text=None):
+        """Queue the change(s) for every member of the room, text is message already encoded as JSON"""
         if session_id not in self.active_connections:
             print(f"No session id of: {session_id} found for broadcasting")
             return False
@@ -63,17 +406,120 @@ class WebsocketManager:
             print(f"No websockets found in session {session_id}")
             print(f"Removing empty session room: {session_id}")
             del self.active_connections[session_id]
-        for client, websocket in session_websockets.items():
-            await websocket.send_json(message)
-        print(f"Sent {message} to all {len(session_websockets)} members of session {session_id}")
+        # Encoded once per encoding for the whole room, and only queued here, every client's writer sends at its own pace
+        payloads = {} if text is None else {"json": text}
+        for client, websocket in list(session_websockets.items()):
+            outbox = self.outboxes.get(websocket)
+            if outbox is None:
+                continue
+            if outbox.encoding not in payloads:
+                payloads[outbox.encoding] = self.encode(message, outbox.encoding)
+            self.enqueue(websocket, payloads[outbox.encoding])
+        print(f"Queued {message} for all {len(session_websockets)} members of session {session_id}")
+
+    def encode(self, message, encoding="json"):
+        if encoding == "msgpack":
+            return msgpack.packb(message)
+        # Same separators as WebSocket.send_json
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def send_to_client(self, websocket: WebSocket, message):
+        """Queue a frame for a single client, in its own encoding"""
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            return False
+        return self.enqueue(websocket, self.encode(message, outbox.encoding))
+
+    def enqueue(self, websocket: WebSocket, message):
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            return False
+        if not outbox.put(message):
+            # Fell too far behind to catch up -> dropped, it resyncs from the change log when it reconnects
+            asyncio.get_running_loop().create_task(self.evict(outbox, "overflow"))
+            return False
+        return True
+
+    async def evict(self, outbox: ClientOutbox, reason):
+        """Drop a client that can't keep up with its room, closing the connection with 1013 (try again later)"""
+        if self.outboxes.get(outbox.websocket) is not outbox:
+            return
+        self.counters[f"evicted_{reason}"] += 1
+        print(f"Dropping slow client #{outbox.participant_id} of session {outbox.session_id}, send {reason}")
+        await self.disconnect(outbox.session_id, outbox.websocket)
+        try:
+            await asyncio.wait_for(outbox.websocket.close(code=1013), timeout=self.send_timeout_seconds)
+        except Exception as e:
+            print(f"Error closing websocket of #{outbox.participant_id}. {e}")
+
+    def drop_pending_frame(self, session_id):
+        handle = self.flush_handles.pop(session_id, None)
+        if handle is not None:
+            handle.cancel()
+        self.pending_frames.pop(session_id, None)
+        self.send_locks.pop(session_id, None)
+
+    def stats(self):
+        return {
+            "coalesce_window_ms": self.coalesce_window_seconds * 1000,
+            "coalesce_max_batch": self.coalesce_max_batch,
+            "pending_events": sum(len(frame) for frame in self.pending_frames.values()),
+            "send_queue_size": self.send_queue_size,
+            "send_timeout_ms": self.send_timeout_seconds * 1000,
+            "clients": len(self.outboxes),
+            "reconnect_grace_ms": self.reconnect_grace_seconds * 1000,
+            "pending_participant_removals": len(self.pending_removals),
+            "clients_per_encoding": {
+                encoding: sum(outbox.encoding == encoding for outbox in self.outboxes.values()) for encoding in self.ENCODINGS
+            },
+            "queued_frames": sum(outbox.queue.qsize() for outbox in self.outboxes.values()),
+            "max_queue_depth": max((outbox.queue.qsize() for outbox in self.outboxes.values()), default=0),
+            **self.counters
+        }
+
+    def room_stats(self):
+        """Gauges per live room, rooms with no clients or resources left over show up here as leaks"""
+        listener = self.notification_listener
+        rooms = {}
+        for session_id in set(self.active_connections) | set(listener.room_projects) | set(self.pending_frames):
+            project_id = listener.room_projects.get(session_id)
+            rooms[session_id] = {
+                "project_id": project_id,
+                "clients": len(self.active_connections.get(session_id, {})),
+                "channels": len(listener.get_project_channels(project_id)) if project_id is not None else 0,
+                "pending_events": len(self.pending_frames.get(session_id, {})),
+                "queue_depths": {
+                    participant_id: self.outboxes[websocket].queue.qsize()
+                    for participant_id, websocket in self.active_connections.get(session_id, {}).items()
+                    if websocket in self.outboxes
+                }
+            }
+        return rooms
+
+    async def shutdown(self):
+        """Close every client and the LISTEN connection, used on server shutdown"""
+        for handle in self.pending_removals.values():
+            handle.cancel()
+        self.pending_removals.clear()
+        for session_id in list(self.active_connections):
+            self.drop_pending_frame(session_id)
+            for websocket in list(self.active_connections.pop(session_id, {}).values()):
+                outbox = self.outboxes.pop(websocket, None)
+                if outbox is not None:
+                    outbox.close()
+                try:
+                    await websocket.close(code=1001)
+                except Exception as e:
+                    print(f"Error closing websocket of session {session_id}. {e}")
+        await self.notification_listener.shutdown()
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        self.enqueue(websocket, message)
 
     async def broadcast(self, message: str):
         print(f"Sending {message} to all active connections")
-        for session_participants in self.active_connections.values():
-            for websocket in session_participants.values():
-                await websocket.send_text(message)
+        for session_participants in list(self.active_connections.values()):
+            for websocket in list(session_participants.values()):
+                self.enqueue(websocket, message)
 
 
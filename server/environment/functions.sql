@@ -63,3 +63,132 @@ BEGIN
     END IF;
 END;
 $$ LANGUAGE plpgsql;
+
+-- Id only variant of notify_changes_after_insert. The payload is just (operation, table, id), so it stays far below
+-- the 8000 byte NOTIFY limit however long the row is, and the server loads the changed rows in batches itself.
+-- TG_ARGV[0] -> primary key column of the table, e.g. EXECUTE FUNCTION notify_change_ids('id')
+CREATE OR REPLACE FUNCTION notify_change_ids()
+RETURNS TRIGGER AS
+$$
+DECLARE
+    channel_name TEXT;
+    identifier TEXT;
+    changed_row JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := to_jsonb(OLD);
+    ELSE
+        changed_row := to_jsonb(NEW);
+    END IF;
+
+    -- Same channel routing as notify_changes_after_insert -> project_id, or the project of the row's session
+    identifier := changed_row ->> 'project_id';
+    IF identifier IS NULL AND changed_row ? 'session_uuid' THEN
+        SELECT project_id::TEXT INTO identifier
+        FROM sessions
+        WHERE session_id = (changed_row ->> 'session_uuid')::UUID;
+        identifier := COALESCE(identifier, changed_row ->> 'session_uuid');
+    END IF;
+    channel_name := format('%I_channel_%s', TG_TABLE_NAME, COALESCE(identifier, 'public'));
+
+    PERFORM pg_notify(
+        channel_name,
+        json_build_object('operation', TG_OP, 'table', TG_TABLE_NAME, 'id', changed_row -> TG_ARGV[0])::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement level notifiers. One trigger call per statement reads every changed row from the transition table
+-- (REFERENCING NEW TABLE AS new_rows / OLD TABLE AS old_rows) and sends one notification per project,
+-- {"operation", "table", "ids": [...]}, with the ids split in chunks to stay below the 8000 byte NOTIFY limit.
+
+CREATE OR REPLACE FUNCTION notify_changed_ids(operation TEXT, table_name TEXT, identifier TEXT, ids BIGINT[])
+RETURNS VOID AS
+$$
+DECLARE
+    chunk_size CONSTANT INT := 500;
+    channel_name TEXT := format('%I_channel_%s', table_name, COALESCE(identifier, 'public'));
+BEGIN
+    FOR chunk_start IN 1 .. COALESCE(array_length(ids, 1), 0) BY chunk_size LOOP
+        PERFORM pg_notify(
+            channel_name,
+            json_build_object(
+                'operation', operation,
+                'table', table_name,
+                'ids', ids[chunk_start : chunk_start + chunk_size - 1]
+            )::text
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_projects_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, ARRAY[project_id::BIGINT]) FROM old_rows;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, ARRAY[project_id::BIGINT]) FROM new_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_tasks_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM old_rows GROUP BY project_id;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM new_rows GROUP BY project_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_messages_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM old_rows GROUP BY project_id;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM new_rows GROUP BY project_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Participants have no project_id -> one join with sessions per statement. When the session itself is being
+-- deleted (ON DELETE CASCADE) it's already gone, then the session id is the channel identifier like before.
+CREATE OR REPLACE FUNCTION notify_session_participants_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, identifier, ids)
+        FROM (
+            SELECT COALESCE(sessions.project_id::TEXT, old_rows.session_uuid::TEXT) AS identifier,
+                array_agg(old_rows.participant_id::BIGINT ORDER BY old_rows.participant_id) AS ids
+            FROM old_rows LEFT JOIN sessions ON sessions.session_id = old_rows.session_uuid
+            GROUP BY 1
+        ) changed;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, identifier, ids)
+        FROM (
+            SELECT COALESCE(sessions.project_id::TEXT, new_rows.session_uuid::TEXT) AS identifier,
+                array_agg(new_rows.participant_id::BIGINT ORDER BY new_rows.participant_id) AS ids
+            FROM new_rows LEFT JOIN sessions ON sessions.session_id = new_rows.session_uuid
+            GROUP BY 1
+        ) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
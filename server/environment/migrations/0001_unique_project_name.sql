@@ -0,0 +1,23 @@
+-- Migration 0001: unique project names
+-- Project inserts use ON CONFLICT (project_name) DO NOTHING, which needs a unique index to infer the conflict target.
+-- Same name as the constraint index tables.sql creates, so this is a no-op on fresh databases.
+-- Databases created before the constraint can already hold duplicate names. The oldest project keeps its name,
+-- the later ones get their project_id appended ("name (42)"), so the index can be built.
+
+BEGIN;
+
+LOCK TABLE projects IN SHARE ROW EXCLUSIVE MODE;
+
+UPDATE projects
+SET project_name = left(duplicates.project_name, 240) || ' (' || duplicates.project_id || ')'
+FROM (
+    SELECT project_id, project_name,
+           row_number() OVER (PARTITION BY project_name ORDER BY project_id) AS position
+    FROM projects
+) AS duplicates
+WHERE projects.project_id = duplicates.project_id
+  AND duplicates.position > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS projects_project_name_key ON projects (project_name);
+
+COMMIT;
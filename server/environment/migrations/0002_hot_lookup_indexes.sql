@@ -0,0 +1,15 @@
+-- Migration 0002: indexes for the hot lookup columns
+-- Every request filters on a non primary key column, which without these is a sequential scan.
+-- Checked with benchmarks/index_plans.py (EXPLAIN ANALYZE before and after this migration).
+
+-- TaskHandler.get_project_tasks -> WHERE project_id = ?, id keeps keyset pages on the same index
+CREATE INDEX IF NOT EXISTS tasks_project_id_idx ON tasks (project_id, id);
+
+-- MessageHandler.get_project_messages -> WHERE project_id = ?. Replaced by (project_id, id) in 0005, pages are keyed on id
+CREATE INDEX IF NOT EXISTS messages_project_id_timestamp_idx ON messages (project_id, message_timestamp);
+
+-- SessionParticipantHandler.get_session_participants -> WHERE session_uuid = ?
+CREATE INDEX IF NOT EXISTS session_participants_session_uuid_idx ON session_participants (session_uuid);
+
+-- SessionHandler.is_valid_session(project_id=...) and participant lookups by project -> WHERE project_id = ?
+CREATE INDEX IF NOT EXISTS sessions_project_id_idx ON sessions (project_id);
@@ -0,0 +1,130 @@
+-- Migration 0003: id only change notifications
+-- Switches the notify triggers from notify_changes_after_insert (whole row_to_json in the payload) to notify_change_ids,
+-- which only sends (operation, table, id). Rows with long task descriptions or chat messages can no longer push
+-- the payload over the 8000 byte NOTIFY limit and fail the writing transaction.
+-- The server's NotificationListener loads the announced rows with one batched SELECT per table before broadcasting.
+-- It still understands whole row payloads, so recreating the triggers with notify_changes_after_insert() switches back.
+
+-- Same function as in functions.sql. TG_ARGV[0] -> primary key column of the table, e.g. EXECUTE FUNCTION notify_change_ids('id')
+CREATE OR REPLACE FUNCTION notify_change_ids()
+RETURNS TRIGGER AS
+$$
+DECLARE
+    channel_name TEXT;
+    identifier TEXT;
+    changed_row JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := to_jsonb(OLD);
+    ELSE
+        changed_row := to_jsonb(NEW);
+    END IF;
+
+    -- Same channel routing as notify_changes_after_insert -> project_id, or the project of the row's session
+    identifier := changed_row ->> 'project_id';
+    IF identifier IS NULL AND changed_row ? 'session_uuid' THEN
+        SELECT project_id::TEXT INTO identifier
+        FROM sessions
+        WHERE session_id = (changed_row ->> 'session_uuid')::UUID;
+        identifier := COALESCE(identifier, changed_row ->> 'session_uuid');
+    END IF;
+    channel_name := format('%I_channel_%s', TG_TABLE_NAME, COALESCE(identifier, 'public'));
+
+    PERFORM pg_notify(
+        channel_name,
+        json_build_object('operation', TG_OP, 'table', TG_TABLE_NAME, 'id', changed_row -> TG_ARGV[0])::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TABLE: projects
+DROP TRIGGER IF EXISTS trigger_notify_projects_insert ON projects;
+CREATE TRIGGER trigger_notify_projects_insert
+AFTER INSERT
+ON projects
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('project_id');
+
+DROP TRIGGER IF EXISTS trigger_notify_projects_update ON projects;
+CREATE TRIGGER trigger_notify_projects_update
+AFTER UPDATE
+ON projects
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('project_id');
+
+DROP TRIGGER IF EXISTS trigger_notify_projects_delete ON projects;
+CREATE TRIGGER trigger_notify_projects_delete
+AFTER DELETE
+ON projects
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('project_id');
+
+
+-- TABLE: tasks
+DROP TRIGGER IF EXISTS trigger_notify_tasks_insert ON tasks;
+CREATE TRIGGER trigger_notify_tasks_insert
+AFTER INSERT
+ON tasks
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+DROP TRIGGER IF EXISTS trigger_notify_tasks_update ON tasks;
+CREATE TRIGGER trigger_notify_tasks_update
+AFTER UPDATE
+ON tasks
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+DROP TRIGGER IF EXISTS trigger_notify_tasks_delete ON tasks;
+CREATE TRIGGER trigger_notify_tasks_delete
+AFTER DELETE
+ON tasks
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+
+-- TABLE: messages
+DROP TRIGGER IF EXISTS trigger_notify_messages_insert ON messages;
+CREATE TRIGGER trigger_notify_messages_insert
+AFTER INSERT
+ON messages
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+DROP TRIGGER IF EXISTS trigger_notify_messages_update ON messages;
+CREATE TRIGGER trigger_notify_messages_update
+AFTER UPDATE
+ON messages
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+DROP TRIGGER IF EXISTS trigger_notify_messages_delete ON messages;
+CREATE TRIGGER trigger_notify_messages_delete
+AFTER DELETE
+ON messages
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('id');
+
+
+-- TABLE: session_participants
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_insert ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_insert
+AFTER INSERT
+ON session_participants
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('participant_id');
+
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_update ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_update
+AFTER UPDATE
+ON session_participants
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('participant_id');
+
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_delete ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_delete
+AFTER DELETE
+ON session_participants
+FOR EACH ROW
+EXECUTE FUNCTION notify_change_ids('participant_id');
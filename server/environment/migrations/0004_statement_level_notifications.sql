@@ -0,0 +1,199 @@
+-- Migration 0004: statement level change notifications
+-- Replaces the FOR EACH ROW notify triggers with FOR EACH STATEMENT triggers reading the changed rows from
+-- transition tables. A 1000 row UPDATE now runs one plpgsql call and sends one notification per project
+-- (ids chunked by 500) instead of 1000 calls and 1000 NOTIFYs. Payloads are id only like migration 0003,
+-- the server loads the rows in batches. Compared with the row level triggers in benchmarks/trigger_bulk_dml.py.
+-- Transition tables can't be shared by multiple events, so every table keeps one trigger per operation.
+
+CREATE OR REPLACE FUNCTION notify_changed_ids(operation TEXT, table_name TEXT, identifier TEXT, ids BIGINT[])
+RETURNS VOID AS
+$$
+DECLARE
+    chunk_size CONSTANT INT := 500;
+    channel_name TEXT := format('%I_channel_%s', table_name, COALESCE(identifier, 'public'));
+BEGIN
+    FOR chunk_start IN 1 .. COALESCE(array_length(ids, 1), 0) BY chunk_size LOOP
+        PERFORM pg_notify(
+            channel_name,
+            json_build_object(
+                'operation', operation,
+                'table', table_name,
+                'ids', ids[chunk_start : chunk_start + chunk_size - 1]
+            )::text
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_projects_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, ARRAY[project_id::BIGINT]) FROM old_rows;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, ARRAY[project_id::BIGINT]) FROM new_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_tasks_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM old_rows GROUP BY project_id;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM new_rows GROUP BY project_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_messages_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM old_rows GROUP BY project_id;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, project_id::TEXT, array_agg(id::BIGINT ORDER BY id))
+        FROM new_rows GROUP BY project_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Participants have no project_id -> one join with sessions per statement. When the session itself is being
+-- deleted (ON DELETE CASCADE) it's already gone, then the session id is the channel identifier like before.
+CREATE OR REPLACE FUNCTION notify_session_participants_changes()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, identifier, ids)
+        FROM (
+            SELECT COALESCE(sessions.project_id::TEXT, old_rows.session_uuid::TEXT) AS identifier,
+                array_agg(old_rows.participant_id::BIGINT ORDER BY old_rows.participant_id) AS ids
+            FROM old_rows LEFT JOIN sessions ON sessions.session_id = old_rows.session_uuid
+            GROUP BY 1
+        ) changed;
+    ELSE
+        PERFORM notify_changed_ids(TG_OP, TG_TABLE_NAME, identifier, ids)
+        FROM (
+            SELECT COALESCE(sessions.project_id::TEXT, new_rows.session_uuid::TEXT) AS identifier,
+                array_agg(new_rows.participant_id::BIGINT ORDER BY new_rows.participant_id) AS ids
+            FROM new_rows LEFT JOIN sessions ON sessions.session_id = new_rows.session_uuid
+            GROUP BY 1
+        ) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TABLE: projects
+DROP TRIGGER IF EXISTS trigger_notify_projects_insert ON projects;
+CREATE TRIGGER trigger_notify_projects_insert
+AFTER INSERT
+ON projects
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_projects_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_projects_update ON projects;
+CREATE TRIGGER trigger_notify_projects_update
+AFTER UPDATE
+ON projects
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_projects_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_projects_delete ON projects;
+CREATE TRIGGER trigger_notify_projects_delete
+AFTER DELETE
+ON projects
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_projects_changes();
+
+
+-- TABLE: tasks
+DROP TRIGGER IF EXISTS trigger_notify_tasks_insert ON tasks;
+CREATE TRIGGER trigger_notify_tasks_insert
+AFTER INSERT
+ON tasks
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_tasks_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_tasks_update ON tasks;
+CREATE TRIGGER trigger_notify_tasks_update
+AFTER UPDATE
+ON tasks
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_tasks_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_tasks_delete ON tasks;
+CREATE TRIGGER trigger_notify_tasks_delete
+AFTER DELETE
+ON tasks
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_tasks_changes();
+
+
+-- TABLE: messages
+DROP TRIGGER IF EXISTS trigger_notify_messages_insert ON messages;
+CREATE TRIGGER trigger_notify_messages_insert
+AFTER INSERT
+ON messages
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_messages_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_messages_update ON messages;
+CREATE TRIGGER trigger_notify_messages_update
+AFTER UPDATE
+ON messages
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_messages_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_messages_delete ON messages;
+CREATE TRIGGER trigger_notify_messages_delete
+AFTER DELETE
+ON messages
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_messages_changes();
+
+
+-- TABLE: session_participants
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_insert ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_insert
+AFTER INSERT
+ON session_participants
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_session_participants_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_update ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_update
+AFTER UPDATE
+ON session_participants
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_session_participants_changes();
+
+DROP TRIGGER IF EXISTS trigger_notify_session_participants_delete ON session_participants;
+CREATE TRIGGER trigger_notify_session_participants_delete
+AFTER DELETE
+ON session_participants
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_session_participants_changes();
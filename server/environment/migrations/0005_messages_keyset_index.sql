@@ -0,0 +1,7 @@
+-- Migration 0005: index messages the way MessageHandler.get_project_messages reads them
+-- Its keyset pages (_get_page) run WHERE project_id = ? AND id > ? ORDER BY id LIMIT ?, which the
+-- (project_id, message_timestamp) index from 0002 can't serve without a sort.
+
+CREATE INDEX IF NOT EXISTS messages_project_id_idx ON messages (project_id, id);
+
+DROP INDEX IF EXISTS messages_project_id_timestamp_idx;
@@ -42,4 +42,27 @@ do
     fi
 done
 
+# Migrations are applied in file name order, each version only once
+echo "Running migrations..."
+psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" -c "CREATE TABLE IF NOT EXISTS schema_migrations (version TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now());"
+for file in migrations/*.sql
+do
+    migration=$(basename "$file")
+    version="${migration%%_*}"
+    if psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" -tAc "SELECT 1 FROM schema_migrations WHERE version='$version'" | grep -q 1; then
+        echo "Migration $migration already applied, skipping."
+        continue
+    fi
+    echo "Copying $file to $postgres_sql_folder"
+    sudo cp "$file" "$postgres_sql_folder/$migration"
+    sudo chown postgres:postgres "$postgres_sql_folder/$migration"
+    echo "Executing $migration..."
+    if psql -v ON_ERROR_STOP=1 -U "$POSTGRES_USER" -d "$POSTGRES_DB" -f "$postgres_sql_folder/$migration"; then
+        psql -U "$POSTGRES_USER" -d "$POSTGRES_DB" -c "INSERT INTO schema_migrations (version) VALUES ('$version');"
+    else
+        echo "Migration $migration failed, stopping."
+        break
+    fi
+done
+
 echo "If no error messages on the screen, it maybe worked :)"
\ No newline at end of file
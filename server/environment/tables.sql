@@ -3,7 +3,7 @@
 -- Table: projects
 CREATE TABLE projects (
     project_id SERIAL PRIMARY KEY,
-    project_name VARCHAR(255) NOT NULL,
+    project_name VARCHAR(255) NOT NULL UNIQUE,
     -- No need, for now.
     -- description TEXT,
     created_at DATE NOT NULL,
@@ -1,7 +1,20 @@
 from fastapi import FastAPI
 import uvicorn
-from api import projects, messages, tasks, websockets
+from contextlib import asynccontextmanager
+from api import projects, messages, tasks, websockets, metrics
+from core.utils.database import db_pool
+from core.async_sql_interface import db_executor, db_connection_executor
 from core.utils.exceptions import centralized_error_handling
+from core.websocket_compression import CompressedWebSocketProtocol
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await websockets.websocket_manager.shutdown()
+    # Release the database worker threads and pooled PostgreSQL connections on shutdown
+    db_executor.shutdown(wait=False)
+    db_connection_executor.shutdown(wait=False)
+    db_pool.close()
 
 """
 If the debug property is True, the errors raised during request handling will be returned to client by FastAPI by default,
@@ -9,12 +22,14 @@ and the centralized_error_handler won't work. If it is set to False, then it sho
 """
 app = FastAPI(
     title="NoniAPI",
-    debug=False
+    debug=False,
+    lifespan=lifespan
 )
 app.include_router(projects.router)
 app.include_router(messages.router)
 app.include_router(tasks.router)
 app.include_router(websockets.router)
+app.include_router(metrics.router)
 
 @centralized_error_handling
 @app.get("/")
@@ -22,10 +37,12 @@ async def root():
     return "This is the root of Noni API"
 
 if __name__ == "__main__":
-    """Start the server with -> fastapi dev main.py"""
+    """Start the server with -> python main.py (fastapi dev / uvicorn main:app skip the compression tuning)"""
     uvicorn.run(
         app="main:app", 
         host="localhost", 
         port=8000,
+        # Tunable permessage-deflate, see WEBSOCKET_COMPRESSION_* in environment/.env.development
+        ws=CompressedWebSocketProtocol,
         reload=True
     )
\ No newline at end of file
@@ -351,26 +351,29 @@ class ManagementScreen(Screen):
         async with session.get(url) as response:
             if response.status == 200:
                 all_messages = await response.json()
-                if not all_messages:
-                    self.use_default_chat_message()
-                    return
-                # Sort last 10 messages by time -> add to chat
-                last_10 = sorted(all_messages, key=lambda m: m.get("message_timestamp", ""), reverse=True)[:10]
-                last_10.reverse() 
-                message_list = self.query_one("#chat-messages", ListView)
-                message_list.clear()
-                for msg in last_10:
-                    widget = Message(
-                        message_content=msg["message_content"],
-                        message_sender=msg["message_sender"],
-                        message_time=msg["message_timestamp"]
-                    )
-                    message_list.append(widget)
-                message_list.scroll_end()
+                self.populate_messages(all_messages)
             else:
                 self.notify(f"Failed to fetch messages: {response.status}")
                 self.use_default_chat_message()
 
+    def populate_messages(self, all_messages: list[dict]):
+        if not all_messages:
+            self.use_default_chat_message()
+            return
+        # Sort last 10 messages by time -> add to chat
+        last_10 = sorted(all_messages, key=lambda m: m.get("message_timestamp", ""), reverse=True)[:10]
+        last_10.reverse() 
+        message_list = self.query_one("#chat-messages", ListView)
+        message_list.clear()
+        for msg in last_10:
+            widget = Message(
+                message_content=msg["message_content"],
+                message_sender=msg["message_sender"],
+                message_time=msg["message_timestamp"]
+            )
+            message_list.append(widget)
+        message_list.scroll_end()
+
     @safe_async_call
     async def populate_tasks(self, tasks_data: list[dict]):
         tabs = {
@@ -467,7 +470,10 @@ class ManagementScreen(Screen):
     async def on_websocket_message(self, updated_data):
         operation = updated_data.get("operation")
         table = updated_data.get("table")
-        if operation == "INSERT":
+        if operation == "SNAPSHOT":
+            # Missed too much while disconnected to replay -> reload everything from the server's snapshot
+            await self.apply_snapshot(updated_data.get("snapshot_data", {}))
+        elif operation == "INSERT":
             new_data = updated_data.get("new_data")
             if table == "tasks":
                 self.handle_task_insert(new_data)
@@ -500,6 +506,13 @@ class ManagementScreen(Screen):
         else:
             self.notify(f"Unsupported operation: {operation}")
 
+    async def apply_snapshot(self, snapshot_data):
+        await self.populate_tasks(snapshot_data.get("tasks", []))
+        self.populate_messages(snapshot_data.get("messages", []))
+        self.participants = {p['participant_id']: p['participant_name'] for p in snapshot_data.get("participants", [])}
+        self.update_participant_container()
+        self.notify("Reloaded project after reconnecting.")
+
     def handle_task_insert(self, new_data):
         task_type = new_data.get("task_type", "backlog")
         task_list = self.task_lists.get(task_type)
@@ -544,8 +557,11 @@ class ManagementScreen(Screen):
     def handle_task_delete(self, task_data):
         task_id = task_data["id"]
         task_type = task_data.get("task_type")
-        task_list = self.task_lists.get(task_type)
-        if task_list:
+        # Id only notifications carry no task_type -> look through every list
+        task_lists = [(task_type, self.task_lists.get(task_type))] if task_type else self.task_lists.items()
+        for task_type, task_list in task_lists:
+            if not task_list:
+                continue
             widget = task_list.get_widget_by_id(task_id)
             if widget:
                 widget.remove()  
@@ -1,5 +1,7 @@
 import websockets
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 import json
+import msgpack
 import asyncio
 
 class WebSocketListener:
@@ -10,7 +12,11 @@ class WebSocketListener:
             session_id: str, 
             session_participant_id: int, 
             max_retries: int = 5, 
-            retry_interval: int = 5
+            retry_interval: int = 5,
+            encoding: str = "msgpack",
+            compression: bool = True,
+            compression_window_bits: int = 12,
+            compression_memory_level: int = 5
             ):
         self.screen = screen
         self.on_message_callback = on_message_callback
@@ -20,15 +26,38 @@ class WebSocketListener:
         self.running = False
         self.max_retries = max_retries
         self.retry_interval = retry_interval
+        # Asked for with a subprotocol, servers that don't support it answer in JSON
+        self.encoding = encoding
+        # permessage-deflate offered to the server, it picks the window of its own frames
+        self.extensions = [
+            ClientPerMessageDeflateFactory(
+                client_max_window_bits=compression_window_bits,
+                compress_settings={"memLevel": compression_memory_level}
+            )
+        ] if compression else []
+        # Position in the server's change log, sent back on reconnect to get just the missed changes
+        self.epoch = None
+        self.last_seq = None
+
+    def get_ws_url(self):
+        ws_url = f"ws://localhost:8000/ws/{self.session_id}/{self.session_participant_id}"
+        if self.last_seq is not None:
+            ws_url += f"?since={self.last_seq}&epoch={self.epoch}"
+        return ws_url
 
     async def start(self):
-        ws_url = f"ws://localhost:8000/ws/{self.session_id}/{self.session_participant_id}" 
         retries = 0
-        while retries < self.max_retries:
+        self.running = True
+        while self.running and retries < self.max_retries:
             try:
-                async with websockets.connect(ws_url) as websocket:
+                async with websockets.connect(
+                    self.get_ws_url(),
+                    subprotocols=[f"noni.{self.encoding}"],
+                    extensions=self.extensions,
+                    compression=None
+                ) as websocket:
                     self.ws = websocket
-                    self.running = True
+                    retries = 0
                     self.safe_notify("Connected to WebSocket")
                     while self.running:
                         try:
@@ -39,10 +68,12 @@ class WebSocketListener:
                             self.safe_notify("WebSocket connection closed.")
                             break
                         except asyncio.CancelledError:
+                            self.running = False
                             break
                         except Exception as e:
                             self.safe_notify(f"Error receiving WebSocket message: {e}")
-                break 
+                if not self.running:
+                    break
             except (websockets.exceptions.WebSocketException, ConnectionRefusedError) as e:
                 self.safe_notify(f"WebSocket connection error: {e}")
             except Exception as e:
@@ -55,13 +86,30 @@ class WebSocketListener:
                 self.safe_notify("Max retries reached. Failed to connect to WebSocket.")
                 break
 
-    async def handle_websocket_message(self, message: str):
+    async def handle_websocket_message(self, message):
         try:
             self.safe_notify("Got new message")
-            updated_data = json.loads(message)
-            await self.on_message_callback(updated_data)
+            # Binary frames are MessagePack, text frames JSON
+            updated_data = msgpack.unpackb(message) if isinstance(message, bytes) else json.loads(message)
+            if isinstance(updated_data, dict) and updated_data.get("operation") in ("SYNC", "SNAPSHOT"):
+                self.epoch = updated_data.get("epoch")
+                self.last_seq = updated_data.get("seq")
+                # A snapshot replaces the board, only the changes after its seq go through the filter below
+                if updated_data["operation"] == "SNAPSHOT":
+                    await self.on_message_callback(updated_data)
+                return
+            # Server coalesces bursts of changes into one array frame
+            changes = updated_data if isinstance(updated_data, list) else [updated_data]
+            for change in changes:
+                seq = change.get("seq")
+                if seq is not None:
+                    # Sent again around a replay or snapshot -> already applied
+                    if self.last_seq is not None and seq <= self.last_seq:
+                        continue
+                    self.last_seq = seq
+                await self.on_message_callback(change)
             await asyncio.sleep(0)
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, msgpack.UnpackException) as e:
             print(f"Error decoding WebSocket message: {e}")
         except Exception as e:
             print(f"Unexpected error handling WebSocket message: {e}")